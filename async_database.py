@@ -0,0 +1,283 @@
+from sqlalchemy import delete, insert, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from contextlib import asynccontextmanager
+from models import WaterCounter, WaterMeterLog, SchemaUpgradeError, create_schema
+from config import config
+import queries
+import logging
+from datetime import datetime, timezone
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Счетчиков в одном INSERT при массовом создании (asyncpg ограничивает число параметров запроса)
+COUNTER_BATCH_SIZE = 1000
+
+
+class AsyncDatabaseManager:
+    """Асинхронный аналог DatabaseManager на asyncpg"""
+
+    def __init__(self):
+        self.engine = create_async_engine(
+            config.ASYNC_DATABASE_URL,
+            pool_size=config.ASYNC_DB_POOL_SIZE,
+            max_overflow=config.ASYNC_DB_MAX_OVERFLOW,
+            connect_args={'timeout': config.DB_CONNECT_TIMEOUT}
+        )
+        self.SessionLocal = async_sessionmaker(self.engine, autoflush=False, expire_on_commit=False)
+        self.schema_ready = False
+
+    async def init_schema(self):
+        """
+        Создание таблиц. Если БД недоступна, попытка повторится при следующей записи.
+        Ошибка обновления схемы доступной БД (SchemaUpgradeError) пробрасывается
+        """
+        try:
+            # CREATE INDEX CONCURRENTLY не выполняется в транзакции
+            async with self.engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+                await conn.run_sync(create_schema)
+            self.schema_ready = True
+            logger.info("Database initialized")
+        except SchemaUpgradeError:
+            raise
+        except Exception as e:
+            logger.warning(f"Database unavailable, schema initialization postponed: {e}")
+        return self.schema_ready
+
+    @asynccontextmanager
+    async def get_session(self):
+        session = self.SessionLocal()
+        try:
+            yield session
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Database error: {e}")
+            raise
+        finally:
+            await session.close()
+
+    async def check_connection(self):
+        async with self.get_session() as session:
+            await session.execute(text("SELECT 1"))
+
+    async def dispose(self):
+        await self.engine.dispose()
+
+    async def add_water_pulses(self, records):
+        """
+        Пакетное добавление импульсов одной транзакцией.
+        records - последовательность (counter_id, timestamp, pulse_count),
+        timestamp - время импульса в секундах unix time (пишется как время UTC с часовым поясом,
+        чтобы psycopg2 и asyncpg сохраняли одно и то же значение).
+        Импульсы неизвестных счетчиков не записываются и возвращаются в списке 'rejected'.
+        """
+        try:
+            if not self.schema_ready and not await self.init_schema():
+                return {'success': False, 'error': 'Database schema is not initialized'}
+
+            pulses = defaultdict(int)
+            last_times = {}
+            for counter_id, timestamp, pulse_count in records:
+                pulses[counter_id] += pulse_count
+                last_times[counter_id] = max(last_times.get(counter_id, timestamp), timestamp)
+
+            async with self.get_session() as session:
+                # Медленная запись завершается ошибкой, и импульсы уходят в спул
+                await session.execute(text("SELECT set_config('statement_timeout', :timeout, true)"),
+                                      {'timeout': str(config.DB_WRITE_TIMEOUT_MS)})
+                # Показания всех счетчиков пачки обновляются одним запросом; он же возвращает
+                # id существующих счетчиков
+                totals = [
+                    (counter_id, pulses[counter_id], datetime.fromtimestamp(last_times[counter_id], timezone.utc))
+                    for counter_id in pulses
+                ]
+                known_ids = set((await session.execute(queries.add_pulses_query(totals))).scalars())
+
+                for counter_id in pulses.keys() - known_ids:
+                    logger.error(f"Counter with id {counter_id} not found, "
+                                 f"rejecting {pulses[counter_id]} pulses")
+                rejected = [record for record in records if record[0] not in known_ids]
+
+                rows = [
+                    {'id_sensor': counter_id, 'time': datetime.fromtimestamp(timestamp, timezone.utc)}
+                    for counter_id, timestamp, pulse_count in records
+                    if counter_id in known_ids
+                    for _ in range(pulse_count)
+                ]
+                if rows:
+                    await session.execute(insert(WaterMeterLog), rows)
+
+                logger.debug(f"Added {len(rows)} pulses for {len(known_ids)} counters")
+
+                return {
+                    'success': True,
+                    'pulses_added': len(rows),
+                    'counters': sorted(known_ids),
+                    'rejected': rejected
+                }
+
+        except Exception as e:
+            logger.error(f"Error adding water pulses: {e}")
+            return {'success': False, 'error': str(e)}
+
+    async def get_current_readings(self, site: str = None, group_name: str = None):
+        """Получение текущих показаний всех счетчиков (или счетчиков здания/стояка)"""
+        try:
+            async with self.engine.connect() as conn:
+                return queries.counter_rows_to_dicts(
+                    await conn.execute(queries.current_readings_query(site, group_name))
+                )
+        except Exception as e:
+            logger.error(f"Error getting current readings: {e}")
+            return []
+
+    async def get_counter(self, counter_id: int):
+        """Текущие показания одного счетчика или None"""
+        async with self.engine.connect() as conn:
+            rows = queries.counter_rows_to_dicts(await conn.execute(queries.counter_query(counter_id)))
+        return rows[0] if rows else None
+
+    async def get_counter_history(self, counter_id: int, limit: int = 100):
+        """Получение истории импульсов конкретного счетчика"""
+        try:
+            async with self.engine.connect() as conn:
+                return queries.history_rows_to_dicts(
+                    await conn.execute(queries.counter_history_query(counter_id, limit))
+                )
+        except Exception as e:
+            logger.error(f"Error getting counter history: {e}")
+            return []
+
+    async def get_consumption_for_period(self, counter_id: int, start_time: datetime, end_time: datetime):
+        """
+        Расчет расхода за период для конкретного счетчика.
+        Возвращает количество импульсов и расход в м³
+        """
+        try:
+            async with self.engine.connect() as conn:
+                pulse_count = (await conn.execute(
+                    queries.pulse_count_query(counter_id, start_time, end_time)
+                )).scalar()
+
+            # Расход = количество импульсов * 0.01 м³
+            consumption = pulse_count * 0.01
+
+            return {
+                'counter_id': counter_id,
+                'pulse_count': pulse_count,
+                'consumption_m3': consumption,
+                'consumption_liters': pulse_count * 10.0,
+                'start_time': start_time,
+                'end_time': end_time
+            }
+
+        except Exception as e:
+            logger.error(f"Error calculating consumption: {e}")
+            return {'error': str(e)}
+
+    async def get_all_consumption_for_period(self, start_time: datetime, end_time: datetime,
+                                             site: str = None, group_name: str = None):
+        """Расчет расхода за период для всех счетчиков (или счетчиков здания/стояка)"""
+        try:
+            async with self.engine.connect() as conn:
+                return queries.consumption_rows_to_dicts(
+                    await conn.execute(queries.all_consumption_query(start_time, end_time, site, group_name))
+                )
+        except Exception as e:
+            logger.error(f"Error calculating all consumption: {e}")
+            return []
+
+    async def get_group_consumption_for_period(self, start_time: datetime, end_time: datetime,
+                                               group_by: str = 'site', site: str = None):
+        """
+        Расход за период по группам счетчиков.
+        group_by: 'site' - по зданиям, 'group_name' - по стоякам внутри зданий
+        """
+        try:
+            async with self.engine.connect() as conn:
+                return queries.group_rows_to_dicts(
+                    await conn.execute(queries.group_consumption_query(start_time, end_time, group_by, site))
+                )
+        except Exception as e:
+            logger.error(f"Error calculating group consumption: {e}")
+            return []
+
+    async def create_counter_if_not_exists(self, name: str, site: str = '', group_name: str = ''):
+        """Создание счетчика если его нет. Атомарно за счет уникального ключа (site, name)"""
+        try:
+            async with self.engine.begin() as conn:
+                result = await conn.execute(queries.insert_counter_query(name, site, group_name))
+                counter_id = result.scalar()
+                if counter_id is not None:
+                    logger.info(f"Created new counter '{name}' (site '{site}') with id {counter_id}")
+                    return counter_id
+
+                counter_id = (await conn.execute(queries.counter_id_query(name, site))).scalar()
+                logger.info(f"Counter '{name}' (site '{site}') already exists with id {counter_id}")
+                return counter_id
+
+        except Exception as e:
+            logger.error(f"Error creating counter: {e}")
+            return None
+
+    async def create_counters_if_not_exist(self, counters):
+        """
+        Создание счетчиков пачкой. counters - список словарей name (обязательно), site, group_name.
+        Возвращает id счетчиков в том же порядке или None при ошибке
+        """
+        try:
+            rows = [
+                {'name': counter['name'], 'site': counter.get('site', ''), 'group_name': counter.get('group_name', '')}
+                for counter in counters
+            ]
+            ids = {}
+            async with self.engine.begin() as conn:
+                for start in range(0, len(rows), COUNTER_BATCH_SIZE):
+                    chunk = rows[start:start + COUNTER_BATCH_SIZE]
+                    await conn.execute(queries.insert_counters_query(chunk))
+                    result = await conn.execute(queries.counter_ids_query([(row['site'], row['name']) for row in chunk]))
+                    ids.update(((site, name), counter_id) for counter_id, site, name in result)
+
+            logger.info(f"Initialized {len(ids)} counters")
+            return [ids[(row['site'], row['name'])] for row in rows]
+
+        except Exception as e:
+            logger.error(f"Error creating counters: {e}")
+            return None
+
+    async def reset_counter(self, counter_id: int):
+        """Сброс счетчика (обнуление значения и очистка логов)"""
+        try:
+            async with self.get_session() as session:
+                counter = await session.get(WaterCounter, counter_id)
+
+                if not counter:
+                    return {'success': False, 'error': 'Counter not found'}
+
+                old_value = counter.value
+                counter.value = 0.0
+                counter.last_time = datetime.now()
+
+                await session.execute(
+                    delete(WaterMeterLog).where(WaterMeterLog.id_sensor == counter_id)
+                )
+
+                logger.info(f"Reset counter {counter_id} ({counter.name}) from {old_value} to 0")
+
+                return {
+                    'success': True,
+                    'counter_id': counter_id,
+                    'counter_name': counter.name,
+                    'old_value': old_value,
+                    'new_value': 0.0
+                }
+
+        except Exception as e:
+            logger.error(f"Error resetting counter: {e}")
+            return {'success': False, 'error': str(e)}
+
+
+# Глобальный экземпляр
+async_db_manager = AsyncDatabaseManager()
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+
+from aiohttp import web
+
+from async_web_server import create_app
+from async_mqtt_client import async_mqtt_client
+from async_database import async_db_manager
+from spool import pulse_spool, AsyncSpoolReplayer
+from config import config
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+async def initialize_system():
+    """Инициализация системы в асинхронном режиме"""
+    logger.info("Initializing Smart Water Meter System (asyncio runtime)...")
+
+    await async_db_manager.init_schema()
+
+    # Проверка подключения к БД. Без БД стартуем: импульсы пишутся в спул
+    logger.info("Testing database connection...")
+    try:
+        await async_db_manager.check_connection()
+        logger.info("Database connection successful")
+    except Exception as e:
+        logger.warning(f"Database unavailable, pulses will be spooled to {config.SPOOL_DIR}: {e}")
+
+    await async_mqtt_client.initialize_counters()
+
+    logger.info("System initialization complete")
+
+
+async def replay_pulses(records):
+    """Запись импульсов из спула. До записи строим маппинг счетчиков по БД, чтобы заменить временные id"""
+    if not async_mqtt_client.counters_ready and not await async_mqtt_client.initialize_counters():
+        return {'success': False, 'error': 'Counters are not initialized'}
+    return await async_db_manager.add_water_pulses(async_mqtt_client.resolve_records(records))
+
+
+async def main():
+    await initialize_system()
+
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host='0.0.0.0', port=config.API_PORT)
+    await site.start()
+    logger.info(f"Web server started on port {config.API_PORT}")
+
+    spool_replayer = AsyncSpoolReplayer(
+        pulse_spool,
+        replay_pulses,
+        batch_size=config.SPOOL_REPLAY_BATCH,
+        retry_min=config.SPOOL_RETRY_MIN,
+        retry_max=config.SPOOL_RETRY_MAX
+    )
+
+    logger.info(f"Connecting to MQTT broker at {config.MQTT_HOST}:{config.MQTT_PORT}")
+    tasks = [
+        asyncio.create_task(async_mqtt_client.run(), name='mqtt'),
+        asyncio.create_task(spool_replayer.run(), name='spool-replayer')
+    ]
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        logger.info("Shutting down system...")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await runner.cleanup()
+        # Сообщения, принятые до остановки, дописываем в БД или спул до закрытия пула и спула
+        await async_mqtt_client.drain()
+        await async_db_manager.dispose()
+        pulse_spool.close()
+        logger.info("System shutdown complete")
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
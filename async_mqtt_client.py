@@ -0,0 +1,168 @@
+import asyncio
+import aiomqtt
+import json
+import logging
+import time
+from async_database import async_db_manager
+from spool import pulse_spool, resolve_provisional_ids
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMQTTClient:
+    """Асинхронный аналог MQTTClient: прием импульсов в цикле событий asyncio"""
+
+    def __init__(self):
+        # Контроллеры и их счетчики (config.CONTROLLERS_FILE). Номер контроллера в этом списке -
+        # временный id в спуле до инициализации счетчиков
+        self.controllers = config.CONTROLLERS
+        self._positions = {controller_id: position for position, controller_id in enumerate(self.controllers)}
+        # Маппинг контроллеров к ID счетчиков, строится по БД в initialize_counters
+        self.controller_mapping = {}
+        # Маппинг построен по БД (до этого импульсы пишутся только в спул)
+        self.counters_ready = False
+        self.connected = False
+        self._tasks = set()
+
+    async def initialize_counters(self):
+        """Создание счетчиков если их нет и обновление маппинга. Возвращает True при успехе"""
+        try:
+            counter_ids = await async_db_manager.create_counters_if_not_exist(list(self.controllers.values()))
+
+            if counter_ids is None:
+                # БД недоступна - импульсы уходят в спул, инициализацию повторит перекачка спула
+                logger.warning("Could not initialize counters, pulses will be spooled until the database is available")
+                return False
+
+            self.controller_mapping = dict(zip(self.controllers, counter_ids))
+            self.counters_ready = True
+            logger.info(f"Initialized counters for {len(self.controller_mapping)} controllers")
+            return True
+
+        except Exception as e:
+            logger.error(f"Error initializing counters: {e}")
+            return False
+
+    async def run(self):
+        """Подключение к брокеру и обработка сообщений с автоматическим переподключением"""
+        # Ограничиваем число одновременно обрабатываемых сообщений размером пула соединений
+        semaphore = asyncio.Semaphore(config.ASYNC_DB_POOL_SIZE)
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    config.MQTT_HOST, config.MQTT_PORT, keepalive=config.MQTT_KEEPALIVE
+                ) as client:
+                    async with client.messages() as messages:
+                        await client.subscribe([
+                            ("water_meter/pulse/#", 0),  # Импульсы счетчиков
+                            ("water_meter/status", 0),  # Статус контроллеров
+                            ("water_meter/command", 0)  # Команды
+                        ])
+                        self.connected = True
+                        logger.info(f"MQTT client connected to {config.MQTT_HOST}:{config.MQTT_PORT}")
+
+                        async for message in messages:
+                            await semaphore.acquire()
+                            task = asyncio.create_task(self.on_message(message))
+                            self._tasks.add(task)
+                            task.add_done_callback(self._tasks.discard)
+                            task.add_done_callback(lambda _: semaphore.release())
+
+            except aiomqtt.MqttError as e:
+                logger.error(f"MQTT connection lost, reconnecting in {config.MQTT_RECONNECT_INTERVAL}s: {e}")
+            finally:
+                self.connected = False
+
+            await asyncio.sleep(config.MQTT_RECONNECT_INTERVAL)
+
+    async def drain(self):
+        """Ожидание обработки уже принятых сообщений (при остановке), чтобы импульсы не потерялись"""
+        if self._tasks:
+            logger.info(f"Waiting for {len(self._tasks)} MQTT messages in progress")
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def on_message(self, msg):
+        try:
+            topic = msg.topic.value
+            payload = msg.payload.decode('utf-8')
+
+            logger.debug(f"Received MQTT: {topic} -> {payload}")
+
+            if topic.startswith('water_meter/pulse/'):
+                await self.handle_pulse_message(topic, payload)
+            elif topic == 'water_meter/status':
+                self.handle_status_message(payload)
+
+        except Exception as e:
+            logger.error(f"Error processing MQTT message: {e}")
+
+    async def handle_pulse_message(self, topic, payload):
+        """Обработка импульсных сообщений"""
+        try:
+            data = json.loads(payload)
+
+            parts = topic.split('/')
+            if len(parts) >= 3:
+                controller_id = parts[2]
+            else:
+                controller_id = data.get('controller_id', 'unknown')
+
+            if controller_id not in self._positions:
+                logger.error(f"Unknown controller: {controller_id}")
+                return
+
+            if self.counters_ready:
+                counter_id = self.controller_mapping[controller_id]
+            else:
+                # Маппинг еще не построен по БД: пишем в спул временный id,
+                # который заменится на id счетчика при перекачке (resolve_records)
+                counter_id = -(self._positions[controller_id] + 1)
+
+            pulse_count = data.get('pulse_count', 1)
+            # bool - подкласс int, поэтому true/false из JSON отсекаем явно
+            if (isinstance(pulse_count, bool) or not isinstance(pulse_count, int)
+                    or not 0 < pulse_count <= config.MAX_PULSES_PER_MESSAGE):
+                logger.error(f"Invalid pulse_count from {controller_id}: {pulse_count!r}")
+                return
+
+            logger.info(f"Pulse received from {controller_id} (counter {counter_id}): {pulse_count} pulses")
+
+            timestamp = time.time()
+
+            # Пока в спуле есть непереданные импульсы, пишем в него же, чтобы сохранить порядок
+            # Методы спула ждут его блокировку (ее держит append на время fsync), поэтому вне цикла событий
+            if self.counters_ready and await asyncio.to_thread(pulse_spool.is_empty):
+                result = await async_db_manager.add_water_pulses([(counter_id, timestamp, pulse_count)])
+                if result['success']:
+                    await asyncio.to_thread(pulse_spool.dead_letter, result['rejected'])
+                    logger.info(f"Successfully processed {pulse_count} pulses from {controller_id}")
+                    return
+                logger.warning(f"Database write failed, spooling pulses: {result.get('error')}")
+
+            # Запись и fsync спула - блокирующие операции, выполняем вне цикла событий
+            await asyncio.to_thread(pulse_spool.append, counter_id, timestamp, pulse_count)
+            logger.info(f"Spooled {pulse_count} pulses from {controller_id}")
+
+        except json.JSONDecodeError as e:
+            logger.error(f"Invalid JSON in pulse message: {e}")
+        except Exception as e:
+            logger.error(f"Error handling pulse message: {e}")
+
+    def resolve_records(self, records):
+        """Замена временных id контроллеров (отрицательных) на id счетчиков из построенного маппинга"""
+        return resolve_provisional_ids(records, [self.controller_mapping[c] for c in self.controllers])
+
+    def handle_status_message(self, payload):
+        """Обработка статусных сообщений"""
+        try:
+            data = json.loads(payload)
+            controller_id = data.get('controller_id', 'unknown')
+            logger.info(f"Status from {controller_id}: {data.get('status', 'unknown')}")
+
+        except Exception as e:
+            logger.error(f"Error handling status message: {e}")
+
+
+# Глобальный экземпляр
+async_mqtt_client = AsyncMQTTClient()
@@ -0,0 +1,365 @@
+import asyncio
+from aiohttp import web
+from sqlalchemy import text
+import logging
+import os
+from async_database import async_db_manager
+from spool import pulse_spool
+from reports import consumption_reports, REPORT_KINDS
+from config import config
+from serialization import dumps
+from datetime import datetime
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# Шаблоны и статика ищутся относительно модуля, как во Flask, а не текущего каталога
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+routes = web.RouteTableDef()
+
+# Ответы сериализуются через serialization.dumps (orjson, если установлен)
+json_response = partial(web.json_response, dumps=dumps)
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    """Разрешаем запросы с любых источников, как CORS(app) во Flask-версии"""
+    if request.method == 'OPTIONS':
+        response = web.Response()
+    else:
+        response = await handler(request)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    return response
+
+
+@routes.get('/')
+async def index(request):
+    """Главная страница"""
+    return web.FileResponse(os.path.join(BASE_DIR, 'templates', 'index.html'))
+
+
+@routes.get('/api/current')
+async def get_current_readings(request):
+    """Получение текущих показаний всех счетчиков (фильтры ?site=...&group_name=...)"""
+    try:
+        readings = await async_db_manager.get_current_readings(request.query.get('site'), request.query.get('group_name'))
+        return json_response({
+            'success': True,
+            'data': readings,
+            'timestamp': datetime.now().isoformat(),
+            'count': len(readings)
+        })
+    except Exception as e:
+        logger.error(f"Error getting current readings: {e}")
+        return json_response({'success': False, 'error': str(e)}, status=500)
+
+
+@routes.get('/api/counter/{counter_id:\\d+}')
+async def get_counter_data(request):
+    """Получение данных конкретного счетчика"""
+    try:
+        counter_id = int(request.match_info['counter_id'])
+        current = await async_db_manager.get_counter(counter_id)
+
+        if not current:
+            return json_response({'success': False, 'error': 'Counter not found'}, status=404)
+
+        try:
+            limit = int(request.query.get('limit', 50))
+        except ValueError:
+            limit = 50
+        history = await async_db_manager.get_counter_history(counter_id, limit)
+
+        return json_response({
+            'success': True,
+            'current': current,
+            'history': history,
+            'history_count': len(history)
+        })
+    except Exception as e:
+        logger.error(f"Error getting counter data: {e}")
+        return json_response({'success': False, 'error': str(e)}, status=500)
+
+
+@routes.post('/api/consumption/period')
+async def get_consumption_for_period(request):
+    """Расчет расхода за период"""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data:
+            return json_response({'success': False, 'error': 'No data provided'}, status=400)
+
+        start_str = data.get('start_time')
+        end_str = data.get('end_time')
+        counter_id = data.get('counter_id')  # опционально, если не указан - все счетчики
+
+        if not start_str or not end_str:
+            return json_response({'success': False, 'error': 'start_time and end_time required'}, status=400)
+
+        try:
+            start_time = datetime.fromisoformat(start_str.replace('Z', '+00:00'))
+            end_time = datetime.fromisoformat(end_str.replace('Z', '+00:00'))
+        except ValueError as e:
+            return json_response({'success': False, 'error': f'Invalid date format: {e}'}, status=400)
+
+        if start_time >= end_time:
+            return json_response({'success': False, 'error': 'start_time must be before end_time'}, status=400)
+
+        if counter_id:
+            result = await async_db_manager.get_consumption_for_period(counter_id, start_time, end_time)
+            if 'error' in result:
+                return json_response({'success': False, 'error': result['error']}, status=500)
+
+            return json_response({
+                'success': True,
+                'data': result,
+                'counter_id': counter_id
+            })
+        else:
+            results = await async_db_manager.get_all_consumption_for_period(
+                start_time, end_time, data.get('site'), data.get('group_name')
+            )
+
+            return json_response({
+                'success': True,
+                'data': results,
+                'count': len(results),
+                'start_time': start_time.isoformat(),
+                'end_time': end_time.isoformat()
+            })
+
+    except Exception as e:
+        logger.error(f"Error calculating consumption: {e}")
+        return json_response({'success': False, 'error': str(e)}, status=500)
+
+
+@routes.post('/api/consumption/groups')
+async def get_group_consumption_for_period(request):
+    """Расход за период по зданиям (group_by=site) или стоякам (group_by=group_name)"""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data:
+            return json_response({'success': False, 'error': 'No data provided'}, status=400)
+
+        start_str = data.get('start_time')
+        end_str = data.get('end_time')
+        group_by = data.get('group_by', 'site')
+        site = data.get('site')  # опционально - только одно здание
+
+        if not start_str or not end_str:
+            return json_response({'success': False, 'error': 'start_time and end_time required'}, status=400)
+        if group_by not in ('site', 'group_name'):
+            return json_response({'success': False, 'error': "group_by must be 'site' or 'group_name'"}, status=400)
+
+        try:
+            start_time = datetime.fromisoformat(start_str.replace('Z', '+00:00'))
+            end_time = datetime.fromisoformat(end_str.replace('Z', '+00:00'))
+        except ValueError as e:
+            return json_response({'success': False, 'error': f'Invalid date format: {e}'}, status=400)
+
+        if start_time >= end_time:
+            return json_response({'success': False, 'error': 'start_time must be before end_time'}, status=400)
+
+        results = await async_db_manager.get_group_consumption_for_period(start_time, end_time, group_by, site)
+        return json_response({
+            'success': True,
+            'data': results,
+            'count': len(results),
+            'group_by': group_by,
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat()
+        })
+
+    except Exception as e:
+        logger.error(f"Error calculating group consumption: {e}")
+        return json_response({'success': False, 'error': str(e)}, status=500)
+
+
+@routes.post('/api/counter/reset/{counter_id:\\d+}')
+async def reset_counter(request):
+    """Сброс счетчика"""
+    try:
+        counter_id = int(request.match_info['counter_id'])
+        result = await async_db_manager.reset_counter(counter_id)
+        if result['success']:
+            return json_response({
+                'success': True,
+                'message': f"Counter {counter_id} reset successfully",
+                'data': result
+            })
+        else:
+            return json_response({'success': False, 'error': result.get('error', 'Unknown error')}, status=500)
+    except Exception as e:
+        logger.error(f"Error resetting counter: {e}")
+        return json_response({'success': False, 'error': str(e)}, status=500)
+
+
+@routes.get('/api/health')
+async def health_check(request):
+    """Проверка здоровья системы"""
+    try:
+        await async_db_manager.check_connection()
+
+        return json_response({
+            'status': 'healthy',
+            'timestamp': datetime.now().isoformat(),
+            'database': 'connected',
+            'spool': await asyncio.to_thread(pulse_spool.get_stats),
+            'version': '1.0.0'
+        })
+    except Exception as e:
+        logger.error(f"Health check failed: {e}")
+        return json_response({
+            'status': 'unhealthy',
+            'error': str(e),
+            'spool': await asyncio.to_thread(pulse_spool.get_stats),
+            'timestamp': datetime.now().isoformat()
+        }, status=500)
+
+
+@routes.get('/api/spool')
+async def get_spool_stats(request):
+    """Метрики локального спула импульсов"""
+    return json_response({
+        'success': True,
+        'data': await asyncio.to_thread(pulse_spool.get_stats),
+        'timestamp': datetime.now().isoformat()
+    })
+
+
+@routes.get('/api/grafana/metrics')
+async def get_grafana_metrics(request):
+    """Метрики для Grafana (простые агрегированные данные)"""
+    try:
+        async with async_db_manager.get_session() as session:
+            result = await session.execute(text("""
+                SELECT
+                    wc.name as counter,
+                    COUNT(*) as pulses,
+                    COUNT(*) * 10 as liters_24h,
+                    COUNT(*) * 0.01 as cubic_meters_24h
+                FROM water_meter_log wml
+                JOIN water_counter wc ON wml.id_sensor = wc.id
+                WHERE wml.time >= NOW() - INTERVAL '24 hours'
+                GROUP BY wc.name
+            """))
+
+            metrics = [{
+                'counter': row[0],
+                'pulses_24h': row[1],
+                'liters_24h': row[2],
+                'cubic_meters_24h': str(row[3])
+            } for row in result]
+
+        return json_response({
+            'success': True,
+            'metrics': metrics,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except Exception as e:
+        logger.error(f"Error getting Grafana metrics: {e}")
+        return json_response({'success': False, 'error': str(e)}, status=500)
+
+
+@routes.get('/api/grafana/timeseries')
+async def get_grafana_timeseries(request):
+    """Временные ряды для Grafana"""
+    try:
+        try:
+            hours = int(request.query.get('hours', 24))
+        except ValueError:
+            hours = 24
+
+        async with async_db_manager.get_session() as session:
+            result = await session.execute(text("""
+                SELECT
+                    date_trunc('hour', wml.time) as timestamp,
+                    wc.name as counter,
+                    COUNT(*) as pulses,
+                    COUNT(*) * 10 as liters
+                FROM water_meter_log wml
+                JOIN water_counter wc ON wml.id_sensor = wc.id
+                WHERE wml.time >= NOW() - make_interval(hours => :hours)
+                GROUP BY date_trunc('hour', wml.time), wc.name
+                ORDER BY timestamp
+            """), {'hours': hours})
+
+            timeseries = [{
+                'timestamp': row[0].isoformat() if row[0] else None,
+                'counter': row[1],
+                'pulses': row[2],
+                'liters': row[3]
+            } for row in result]
+
+        return json_response({
+            'success': True,
+            'data': timeseries,
+            'hours': hours
+        })
+
+    except Exception as e:
+        logger.error(f"Error getting timeseries: {e}")
+        return json_response({'success': False, 'error': str(e)}, status=500)
+
+
+@routes.get('/api/reports/{kind}')
+async def get_report(request):
+    """
+    Отчеты по расходу: daily, heatmap, percentiles, monthly, summary.
+    Параметры как во Flask-версии: start, end, counter_id, percentiles
+    """
+    kind = request.match_info['kind']
+    if kind not in REPORT_KINDS:
+        return json_response({'success': False, 'error': f'Unknown report {kind}, expected one of {REPORT_KINDS}'},
+                             status=404)
+
+    try:
+        try:
+            start_time, end_time = consumption_reports.parse_period(
+                request.query.get('start'), request.query.get('end'), config.REPORT_DEFAULT_DAYS
+            )
+
+            counter_ids = [int(x) for x in request.query.get('counter_id', '').split(',') if x.strip()]
+            quantiles = [float(x) for x in request.query.get('percentiles', '').split(',') if x.strip()]
+        except ValueError as e:
+            return json_response({'success': False, 'error': f'Invalid parameter: {e}'}, status=400)
+
+        if start_time >= end_time:
+            return json_response({'success': False, 'error': 'start must be before end'}, status=400)
+        if any(q < 0 or q > 100 for q in quantiles):
+            return json_response({'success': False, 'error': 'percentiles must be between 0 and 100'}, status=400)
+
+        # Отчет строится синхронно (psycopg2 + pandas), поэтому выполняем его в потоке
+        report = await asyncio.to_thread(
+            consumption_reports.build, kind, start_time, end_time, counter_ids or None, quantiles or None
+        )
+
+        return json_response({
+            'success': True,
+            'report': kind,
+            'data': report,
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat(),
+            'timezone': config.REPORT_TIMEZONE
+        })
+
+    except Exception as e:
+        logger.error(f"Error building {kind} report: {e}")
+        return json_response({'success': False, 'error': str(e)}, status=500)
+
+
+def create_app():
+    app = web.Application(middlewares=[cors_middleware])
+    app.add_routes(routes)
+    app.router.add_static('/static/', os.path.join(BASE_DIR, 'static'))
+    return app
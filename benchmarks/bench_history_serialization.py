@@ -0,0 +1,94 @@
+"""
+Микробенчмарк сериализации истории счетчика (get_counter_history -> JSON).
+
+Сравнивает старый путь (ORM-объекты WaterMeterLog, to_dict() и isoformat() на каждую строку,
+стандартный json) с новым (кортежи из Core-запроса и serialization.dumps_bytes).
+
+    python benchmarks/bench_history_serialization.py                  # синтетические строки, без БД
+    python benchmarks/bench_history_serialization.py --db --counter-id 1 --rows 10000 50000
+
+В режиме --db строки читаются из БД, указанной в .env, включая время запроса.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import queries  # noqa: E402
+from models import WaterMeterLog  # noqa: E402
+from serialization import dumps_bytes, orjson  # noqa: E402
+
+
+def synthetic_rows(count):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [(i, 1, start + timedelta(seconds=37 * i, microseconds=i % 1000)) for i in range(count)]
+
+
+def orm_path_synthetic(rows):
+    logs = [WaterMeterLog(id=log_id, id_sensor=id_sensor, time=log_time) for log_id, id_sensor, log_time in rows]
+    return json.dumps({'history': [log.to_dict() for log in logs]}, sort_keys=True).encode('utf-8')
+
+
+def core_path_synthetic(rows):
+    return dumps_bytes({'history': queries.history_rows_to_dicts(rows)}, sort_keys=True)
+
+
+def orm_path_db(db_manager, counter_id, limit):
+    with db_manager.get_session() as session:
+        logs = session.query(WaterMeterLog).filter(
+            WaterMeterLog.id_sensor == counter_id
+        ).order_by(WaterMeterLog.time.desc()).limit(limit).all()
+        history = [log.to_dict() for log in logs]
+    return json.dumps({'history': history}, sort_keys=True).encode('utf-8')
+
+
+def core_path_db(db_manager, counter_id, limit):
+    return dumps_bytes({'history': db_manager.get_counter_history(counter_id, limit)}, sort_keys=True)
+
+
+def measure(func, repeat):
+    best = float('inf')
+    payload = b''
+    for _ in range(repeat):
+        started = time.perf_counter()
+        payload = func()
+        best = min(best, time.perf_counter() - started)
+    return best, payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--db', action='store_true', help='читать строки из БД')
+    parser.add_argument('--counter-id', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"encoder: {'orjson' if orjson is not None else 'json'}, mode: {'db' if args.db else 'synthetic'}")
+    print(f"{'rows':>8} {'orm rows/s':>14} {'core rows/s':>14} {'speedup':>8}")
+
+    if args.db:
+        from database import db_manager
+
+    for count in args.rows:
+        if args.db:
+            orm_time, orm_payload = measure(lambda: orm_path_db(db_manager, args.counter_id, count), args.repeat)
+            core_time, core_payload = measure(lambda: core_path_db(db_manager, args.counter_id, count), args.repeat)
+            count = len(json.loads(core_payload)['history'])
+        else:
+            rows = synthetic_rows(count)
+            orm_time, orm_payload = measure(lambda: orm_path_synthetic(rows), args.repeat)
+            core_time, core_payload = measure(lambda: core_path_synthetic(rows), args.repeat)
+
+        if json.loads(orm_payload) != json.loads(core_payload):
+            raise SystemExit("ORM and Core paths produced different JSON")
+
+        print(f"{count:>8} {count / orm_time:>14,.0f} {count / core_time:>14,.0f} {orm_time / core_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Нагрузочный тест чтения на большом числе счетчиков.
+
+Создает в БД из .env счетчики с site = 'loadtest-...' (по умолчанию 10000 счетчиков,
+100 зданий по 10 стояков) и импульсы к ним, затем через тестовый клиент Flask
+замеряет /api/current и запросы расхода за период. Код возврата 1, если p95
+какого-либо запроса превышает бюджет.
+
+    python benchmarks/load_test_counters.py --counters 10000 --budget-ms 500
+
+Тестовые данные удаляются после прогона (если не указан --keep).
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text  # noqa: E402
+from database import db_manager  # noqa: E402
+from web_server import app  # noqa: E402
+
+SITE_PREFIX = 'loadtest-'
+
+
+def seed(counters, sites, groups, pulses_per_counter, days):
+    with db_manager.engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO water_counter (name, site, group_name, value)
+            SELECT
+                'counter-' || g,
+                :prefix || 'site-' || (g % :sites),
+                'riser-' || ((g / :sites) % :groups),
+                0.0
+            FROM generate_series(1, :counters) g
+            ON CONFLICT (site, name) DO NOTHING
+        """), {'prefix': SITE_PREFIX, 'sites': sites, 'groups': groups, 'counters': counters})
+
+        conn.execute(text("""
+            INSERT INTO water_meter_log (id_sensor, time)
+            SELECT wc.id, NOW() - random() * make_interval(days => :days)
+            FROM water_counter wc, generate_series(1, :pulses)
+            WHERE wc.site LIKE :pattern
+        """), {'days': days, 'pulses': pulses_per_counter, 'pattern': SITE_PREFIX + '%'})
+
+        conn.execute(text("""
+            UPDATE water_counter SET value = :pulses * 0.01, last_time = NOW()
+            WHERE site LIKE :pattern
+        """), {'pulses': pulses_per_counter, 'pattern': SITE_PREFIX + '%'})
+
+    with db_manager.engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(text("ANALYZE water_counter, water_meter_log"))
+
+
+def cleanup():
+    with db_manager.engine.begin() as conn:
+        conn.execute(text("""
+            DELETE FROM water_meter_log
+            WHERE id_sensor IN (SELECT id FROM water_counter WHERE site LIKE :pattern)
+        """), {'pattern': SITE_PREFIX + '%'})
+        conn.execute(text("DELETE FROM water_counter WHERE site LIKE :pattern"), {'pattern': SITE_PREFIX + '%'})
+
+
+def measure(client, method, url, json_body, requests):
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.open(url, method=method, json=json_body)
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200 or not response.get_json().get('success'):
+            raise SystemExit(f"{method} {url} failed: {response.status_code} {response.data[:200]}")
+    timings.sort()
+    return {
+        'p50': statistics.median(timings),
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'max': timings[-1],
+        'rows': response.get_json().get('count')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counters', type=int, default=10000)
+    parser.add_argument('--sites', type=int, default=100)
+    parser.add_argument('--groups', type=int, default=10, help='стояков в здании')
+    parser.add_argument('--pulses-per-counter', type=int, default=100)
+    parser.add_argument('--days', type=int, default=30, help='период, по которому распределены импульсы')
+    parser.add_argument('--requests', type=int, default=20, help='повторов каждого запроса')
+    parser.add_argument('--budget-ms', type=float, default=500.0, help='допустимое p95 для каждого запроса')
+    parser.add_argument('--keep', action='store_true', help='не удалять тестовые данные')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    seed(args.counters, args.sites, args.groups, args.pulses_per_counter, args.days)
+    print(f"seeded {args.counters} counters x {args.pulses_per_counter} pulses "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    end_time = datetime.now()
+    period = {
+        'start_time': (end_time - timedelta(days=args.days)).isoformat(),
+        'end_time': end_time.isoformat()
+    }
+    site = f"{SITE_PREFIX}site-1"
+    with db_manager.engine.connect() as conn:
+        counter_id = conn.execute(
+            text("SELECT id FROM water_counter WHERE site = :site ORDER BY id LIMIT 1"), {'site': site}
+        ).scalar()
+
+    scenarios = [
+        ('GET', '/api/current', None),
+        ('GET', f'/api/current?site={site}', None),
+        ('GET', f'/api/counter/{counter_id}?limit=100', None),
+        ('POST', '/api/consumption/period', dict(period, counter_id=counter_id)),
+        ('POST', '/api/consumption/period', dict(period, site=site)),
+        ('POST', '/api/consumption/period', period),
+        ('POST', '/api/consumption/groups', dict(period, group_by='site')),
+        ('POST', '/api/consumption/groups', dict(period, group_by='group_name', site=site)),
+    ]
+
+    failed = False
+    try:
+        client = app.test_client()
+        print(f"{'request':<62} {'rows':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+        for method, url, body in scenarios:
+            stats = measure(client, method, url, body, args.requests)
+            label = f"{method} {url}" + (f" {sorted(k for k in body if k not in period)}" if body else '')
+            over = stats['p95'] > args.budget_ms
+            failed = failed or over
+            print(f"{label:<62} {stats['rows'] or '':>6} {stats['p50']:>8.1f} {stats['p95']:>8.1f} "
+                  f"{stats['max']:>8.1f}{'  OVER BUDGET' if over else ''}")
+    finally:
+        if not args.keep:
+            cleanup()
+
+    print(f"budget p95 <= {args.budget_ms:.0f} ms: {'FAILED' if failed else 'OK'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
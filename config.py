@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -12,6 +13,10 @@ class Config:
     POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'admin007')
     POSTGRES_DB = os.getenv('POSTGRES_DB', 'smart_home')
 
+    # Таймауты БД: медленная запись импульсов не блокирует прием, импульсы уходят в спул
+    DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '5'))  # секунды
+    DB_WRITE_TIMEOUT_MS = int(os.getenv('DB_WRITE_TIMEOUT_MS', '2000'))  # statement_timeout записи
+
     # MQTT конфигурация
     MQTT_HOST = os.getenv('MQTT_HOST', 'localhost')
     MQTT_PORT = int(os.getenv('MQTT_PORT', '1883'))
@@ -25,9 +30,54 @@ class Config:
     # API конфигурация
     API_PORT = int(os.getenv('API_PORT', '5001'))
 
+    # Локальный спул импульсов (на время недоступности БД)
+    # Относительный путь считается от каталога проекта, а не от текущего каталога
+    SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv('SPOOL_DIR', 'spool'))
+    SPOOL_FSYNC = os.getenv('SPOOL_FSYNC', 'interval')  # always | interval | never
+    SPOOL_FSYNC_INTERVAL = float(os.getenv('SPOOL_FSYNC_INTERVAL', '1.0'))
+    SPOOL_SEGMENT_BYTES = int(os.getenv('SPOOL_SEGMENT_BYTES', str(4 * 1024 * 1024)))
+    SPOOL_MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', str(256 * 1024 * 1024)))
+    SPOOL_DEAD_LETTER_MAX_BYTES = int(os.getenv('SPOOL_DEAD_LETTER_MAX_BYTES', str(16 * 1024 * 1024)))
+    SPOOL_REPLAY_BATCH = int(os.getenv('SPOOL_REPLAY_BATCH', '5000'))
+    SPOOL_RETRY_MIN = float(os.getenv('SPOOL_RETRY_MIN', '1.0'))
+    SPOOL_RETRY_MAX = float(os.getenv('SPOOL_RETRY_MAX', '60.0'))
+    # Максимум импульсов в одном MQTT-сообщении (1 импульс = 10 литров)
+    MAX_PULSES_PER_MESSAGE = int(os.getenv('MAX_PULSES_PER_MESSAGE', '1000'))
+
+    # Контроллеры и их счетчики: JSON-файл (путь от каталога проекта) вида
+    # {"<controller_id>": {"name": "...", "site": "...", "group_name": "..."}, ...}.
+    # Пока в спуле есть импульсы, порядок контроллеров не меняйте: временные id в спуле - их номера
+    CONTROLLERS_FILE = os.getenv('CONTROLLERS_FILE', '')
+    DEFAULT_CONTROLLERS = {
+        'water_meter_controller_001': {'name': 'Холодная вода'},
+        'water_meter_controller_002': {'name': 'Горячая вода'},
+    }
+
+    # Отчеты (reports.py)
+    REPORT_TIMEZONE = os.getenv('REPORT_TIMEZONE', 'UTC')
+    REPORT_CHUNK_SIZE = int(os.getenv('REPORT_CHUNK_SIZE', '100000'))
+    REPORT_DEFAULT_DAYS = int(os.getenv('REPORT_DEFAULT_DAYS', '30'))
+
+    # Асинхронный режим (async_main.py)
+    ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', '10'))
+    ASYNC_DB_MAX_OVERFLOW = int(os.getenv('ASYNC_DB_MAX_OVERFLOW', '20'))
+    MQTT_RECONNECT_INTERVAL = float(os.getenv('MQTT_RECONNECT_INTERVAL', '5.0'))
+
+    @property
+    def CONTROLLERS(self):
+        if not self.CONTROLLERS_FILE:
+            return self.DEFAULT_CONTROLLERS
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.CONTROLLERS_FILE)
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
     @property
     def DATABASE_URL(self):
         return f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
 
+    @property
+    def ASYNC_DATABASE_URL(self):
+        return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+
 
 config = Config()
\ No newline at end of file
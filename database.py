@@ -1,21 +1,41 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, insert
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import func
 from contextlib import contextmanager
-from models import WaterCounter, WaterMeterLog, init_db
+from models import WaterCounter, WaterMeterLog, SchemaUpgradeError, init_db
 from config import config
+import queries
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict
 
 logger = logging.getLogger(__name__)
 
+# Счетчиков в одном INSERT при массовом создании (asyncpg ограничивает число параметров запроса)
+COUNTER_BATCH_SIZE = 1000
+
 
 class DatabaseManager:
     def __init__(self):
-        self.engine = create_engine(config.DATABASE_URL)
+        self.engine = create_engine(config.DATABASE_URL, connect_args={'connect_timeout': config.DB_CONNECT_TIMEOUT})
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
-        init_db()
-        logger.info("Database initialized")
+        self.schema_ready = False
+        self.init_schema()
+
+    def init_schema(self):
+        """
+        Создание таблиц. Если БД недоступна, попытка повторится при следующей записи.
+        Ошибка обновления схемы доступной БД (SchemaUpgradeError) пробрасывается
+        """
+        try:
+            init_db()
+            self.schema_ready = True
+            logger.info("Database initialized")
+        except SchemaUpgradeError:
+            raise
+        except Exception as e:
+            logger.warning(f"Database unavailable, schema initialization postponed: {e}")
+        return self.schema_ready
 
     @contextmanager
     def get_session(self):
@@ -72,118 +92,184 @@ class DatabaseManager:
                 logger.error(f"Error adding water pulse: {e}")
                 return {'success': False, 'error': str(e)}
 
-    def get_current_readings(self):
-        """Получение текущих показаний всех счетчиков"""
-        with self.get_session() as session:
-            try:
-                counters = session.query(WaterCounter).all()
-                return [counter.to_dict() for counter in counters]
-            except Exception as e:
-                logger.error(f"Error getting current readings: {e}")
-                return []
+    def add_water_pulses(self, records):
+        """
+        Пакетное добавление импульсов одной транзакцией.
+        records - последовательность (counter_id, timestamp, pulse_count),
+        timestamp - время импульса в секундах unix time (пишется как время UTC с часовым поясом,
+        чтобы psycopg2 и asyncpg сохраняли одно и то же значение).
+        Импульсы неизвестных счетчиков не записываются и возвращаются в списке 'rejected'.
+        """
+        try:
+            if not self.schema_ready and not self.init_schema():
+                return {'success': False, 'error': 'Database schema is not initialized'}
+
+            pulses = defaultdict(int)
+            last_times = {}
+            for counter_id, timestamp, pulse_count in records:
+                pulses[counter_id] += pulse_count
+                last_times[counter_id] = max(last_times.get(counter_id, timestamp), timestamp)
+
+            with self.get_session() as session:
+                # Медленная запись завершается ошибкой, и импульсы уходят в спул
+                session.execute(text("SELECT set_config('statement_timeout', :timeout, true)"),
+                                {'timeout': str(config.DB_WRITE_TIMEOUT_MS)})
+                # Показания всех счетчиков пачки обновляются одним запросом; он же возвращает
+                # id существующих счетчиков
+                totals = [
+                    (counter_id, pulses[counter_id], datetime.fromtimestamp(last_times[counter_id], timezone.utc))
+                    for counter_id in pulses
+                ]
+                known_ids = set((session.execute(queries.add_pulses_query(totals))).scalars())
+
+                for counter_id in pulses.keys() - known_ids:
+                    logger.error(f"Counter with id {counter_id} not found, "
+                                 f"rejecting {pulses[counter_id]} pulses")
+                rejected = [record for record in records if record[0] not in known_ids]
+
+                rows = [
+                    {'id_sensor': counter_id, 'time': datetime.fromtimestamp(timestamp, timezone.utc)}
+                    for counter_id, timestamp, pulse_count in records
+                    if counter_id in known_ids
+                    for _ in range(pulse_count)
+                ]
+                if rows:
+                    session.execute(insert(WaterMeterLog), rows)
+
+                logger.debug(f"Added {len(rows)} pulses for {len(known_ids)} counters")
+
+                return {
+                    'success': True,
+                    'pulses_added': len(rows),
+                    'counters': sorted(known_ids),
+                    'rejected': rejected
+                }
+
+        except Exception as e:
+            logger.error(f"Error adding water pulses: {e}")
+            return {'success': False, 'error': str(e)}
+
+    def get_current_readings(self, site: str = None, group_name: str = None):
+        """Получение текущих показаний всех счетчиков (или счетчиков здания/стояка)"""
+        try:
+            with self.engine.connect() as conn:
+                return queries.counter_rows_to_dicts(
+                    conn.execute(queries.current_readings_query(site, group_name))
+                )
+        except Exception as e:
+            logger.error(f"Error getting current readings: {e}")
+            return []
+
+    def get_counter(self, counter_id: int):
+        """Текущие показания одного счетчика или None"""
+        with self.engine.connect() as conn:
+            rows = queries.counter_rows_to_dicts(conn.execute(queries.counter_query(counter_id)))
+        return rows[0] if rows else None
 
     def get_counter_history(self, counter_id: int, limit: int = 100):
         """Получение истории импульсов конкретного счетчика"""
-        with self.get_session() as session:
-            try:
-                logs = session.query(WaterMeterLog).filter(
-                    WaterMeterLog.id_sensor == counter_id
-                ).order_by(WaterMeterLog.time.desc()).limit(limit).all()
-
-                return [log.to_dict() for log in logs]
-            except Exception as e:
-                logger.error(f"Error getting counter history: {e}")
-                return []
+        try:
+            with self.engine.connect() as conn:
+                return queries.history_rows_to_dicts(
+                    conn.execute(queries.counter_history_query(counter_id, limit))
+                )
+        except Exception as e:
+            logger.error(f"Error getting counter history: {e}")
+            return []
 
     def get_consumption_for_period(self, counter_id: int, start_time: datetime, end_time: datetime):
         """
         Расчет расхода за период для конкретного счетчика.
         Возвращает количество импульсов и расход в м³
         """
-        with self.get_session() as session:
-            try:
-                # Считаем количество импульсов за период
-                pulse_count = session.query(WaterMeterLog).filter(
-                    WaterMeterLog.id_sensor == counter_id,
-                    WaterMeterLog.time >= start_time,
-                    WaterMeterLog.time <= end_time
-                ).count()
+        try:
+            with self.engine.connect() as conn:
+                pulse_count = conn.execute(queries.pulse_count_query(counter_id, start_time, end_time)).scalar()
 
-                # Расход = количество импульсов * 0.01 м³
-                consumption = pulse_count * 0.01
+            # Расход = количество импульсов * 0.01 м³
+            consumption = pulse_count * 0.01
 
-                return {
-                    'counter_id': counter_id,
-                    'pulse_count': pulse_count,
-                    'consumption_m3': consumption,
-                    'consumption_liters': consumption * 1000,
-                    'start_time': start_time.isoformat(),
-                    'end_time': end_time.isoformat()
-                }
+            return {
+                'counter_id': counter_id,
+                'pulse_count': pulse_count,
+                'consumption_m3': consumption,
+                'consumption_liters': pulse_count * 10.0,
+                'start_time': start_time,
+                'end_time': end_time
+            }
 
-            except Exception as e:
-                logger.error(f"Error calculating consumption: {e}")
-                return {'error': str(e)}
+        except Exception as e:
+            logger.error(f"Error calculating consumption: {e}")
+            return {'error': str(e)}
 
-    def get_all_consumption_for_period(self, start_time: datetime, end_time: datetime):
-        """Расчет расхода за период для всех счетчиков"""
-        with self.get_session() as session:
-            try:
-                # Получаем все счетчики
-                counters = session.query(WaterCounter).all()
-                results = []
-
-                for counter in counters:
-                    pulse_count = session.query(WaterMeterLog).filter(
-                        WaterMeterLog.id_sensor == counter.id,
-                        WaterMeterLog.time >= start_time,
-                        WaterMeterLog.time <= end_time
-                    ).count()
-
-                    consumption = pulse_count * 0.01
-
-                    results.append({
-                        'counter_id': counter.id,
-                        'counter_name': counter.name,
-                        'pulse_count': pulse_count,
-                        'consumption_m3': consumption,
-                        'consumption_liters': consumption * 1000,
-                        'current_value': counter.value
-                    })
-
-                return results
+    def get_all_consumption_for_period(self, start_time: datetime, end_time: datetime,
+                                       site: str = None, group_name: str = None):
+        """Расчет расхода за период для всех счетчиков (или счетчиков здания/стояка)"""
+        try:
+            with self.engine.connect() as conn:
+                return queries.consumption_rows_to_dicts(
+                    conn.execute(queries.all_consumption_query(start_time, end_time, site, group_name))
+                )
+        except Exception as e:
+            logger.error(f"Error calculating all consumption: {e}")
+            return []
 
-            except Exception as e:
-                logger.error(f"Error calculating all consumption: {e}")
-                return []
+    def get_group_consumption_for_period(self, start_time: datetime, end_time: datetime,
+                                         group_by: str = 'site', site: str = None):
+        """
+        Расход за период по группам счетчиков.
+        group_by: 'site' - по зданиям, 'group_name' - по стоякам внутри зданий
+        """
+        try:
+            with self.engine.connect() as conn:
+                return queries.group_rows_to_dicts(
+                    conn.execute(queries.group_consumption_query(start_time, end_time, group_by, site))
+                )
+        except Exception as e:
+            logger.error(f"Error calculating group consumption: {e}")
+            return []
 
-    def create_counter_if_not_exists(self, name: str):
-        """Создание счетчика если его нет"""
-        with self.get_session() as session:
-            try:
-                # Проверяем, существует ли счетчик с таким именем
-                existing = session.query(WaterCounter).filter(
-                    WaterCounter.name == name
-                ).first()
+    def create_counter_if_not_exists(self, name: str, site: str = '', group_name: str = ''):
+        """Создание счетчика если его нет. Атомарно за счет уникального ключа (site, name)"""
+        try:
+            with self.engine.begin() as conn:
+                counter_id = conn.execute(queries.insert_counter_query(name, site, group_name)).scalar()
+                if counter_id is not None:
+                    logger.info(f"Created new counter '{name}' (site '{site}') with id {counter_id}")
+                    return counter_id
 
-                if existing:
-                    logger.info(f"Counter '{name}' already exists with id {existing.id}")
-                    return existing.id
+                counter_id = conn.execute(queries.counter_id_query(name, site)).scalar()
+                logger.info(f"Counter '{name}' (site '{site}') already exists with id {counter_id}")
+                return counter_id
 
-                # Создаем новый счетчик
-                new_counter = WaterCounter(
-                    name=name,
-                    value=0.0
-                )
-                session.add(new_counter)
-                session.flush()  # Получаем ID
+        except Exception as e:
+            logger.error(f"Error creating counter: {e}")
+            return None
 
-                logger.info(f"Created new counter '{name}' with id {new_counter.id}")
-                return new_counter.id
+    def create_counters_if_not_exist(self, counters):
+        """
+        Создание счетчиков пачкой. counters - список словарей name (обязательно), site, group_name.
+        Возвращает id счетчиков в том же порядке или None при ошибке
+        """
+        try:
+            rows = [
+                {'name': counter['name'], 'site': counter.get('site', ''), 'group_name': counter.get('group_name', '')}
+                for counter in counters
+            ]
+            ids = {}
+            with self.engine.begin() as conn:
+                for start in range(0, len(rows), COUNTER_BATCH_SIZE):
+                    chunk = rows[start:start + COUNTER_BATCH_SIZE]
+                    conn.execute(queries.insert_counters_query(chunk))
+                    result = conn.execute(queries.counter_ids_query([(row['site'], row['name']) for row in chunk]))
+                    ids.update(((site, name), counter_id) for counter_id, site, name in result)
+
+            logger.info(f"Initialized {len(ids)} counters")
+            return [ids[(row['site'], row['name'])] for row in rows]
 
-            except Exception as e:
-                logger.error(f"Error creating counter: {e}")
-                return None
+        except Exception as e:
+            logger.error(f"Error creating counters: {e}")
+            return None
 
     def reset_counter(self, counter_id: int):
         """Сброс счетчика (обнуление значения и очистка логов)"""
@@ -498,6 +498,8 @@ ALTER TABLE public.users ALTER COLUMN id ADD GENERATED ALWAYS AS IDENTITY (
 CREATE TABLE public.water_counter (
     id integer NOT NULL,
     name character varying(100) NOT NULL,
+    site character varying(100) DEFAULT ''::character varying NOT NULL,
+    group_name character varying(100) DEFAULT ''::character varying NOT NULL,
     value numeric(15,3) DEFAULT 0.0,
     last_time timestamp with time zone DEFAULT CURRENT_TIMESTAMP
 );
@@ -1865,6 +1867,14 @@ ALTER TABLE ONLY public.water_counter
     ADD CONSTRAINT water_counter_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: water_counter uq_water_counter_site_name; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.water_counter
+    ADD CONSTRAINT uq_water_counter_site_name UNIQUE (site, name);
+
+
 --
 -- Name: water_meter_log water_meter_log_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -1874,17 +1884,17 @@ ALTER TABLE ONLY public.water_meter_log
 
 
 --
--- Name: idx_meter_log_sensor; Type: INDEX; Schema: public; Owner: postgres
+-- Name: idx_water_meter_log_sensor_time; Type: INDEX; Schema: public; Owner: postgres
 --
 
-CREATE INDEX idx_meter_log_sensor ON public.water_meter_log USING btree (id_sensor);
+CREATE INDEX idx_water_meter_log_sensor_time ON public.water_meter_log USING btree (id_sensor, "time");
 
 
 --
--- Name: idx_meter_log_time; Type: INDEX; Schema: public; Owner: postgres
+-- Name: idx_water_meter_log_time; Type: INDEX; Schema: public; Owner: postgres
 --
 
-CREATE INDEX idx_meter_log_time ON public.water_meter_log USING btree ("time");
+CREATE INDEX idx_water_meter_log_time ON public.water_meter_log USING btree ("time");
 
 
 --
@@ -1895,10 +1905,10 @@ CREATE INDEX idx_temp_analysis_hash ON public.temp_analysis USING btree (hash_va
 
 
 --
--- Name: idx_water_counter_name; Type: INDEX; Schema: public; Owner: postgres
+-- Name: idx_water_counter_site_group; Type: INDEX; Schema: public; Owner: postgres
 --
 
-CREATE INDEX idx_water_counter_name ON public.water_counter USING btree (name);
+CREATE INDEX idx_water_counter_site_group ON public.water_counter USING btree (site, group_name);
 
 
 --
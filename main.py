@@ -7,6 +7,7 @@ from web_server import app
 from mqtt_client import mqtt_client
 from config import config
 from database import db_manager
+from spool import pulse_spool, SpoolReplayer
 
 # Настройка логирования
 logging.basicConfig(
@@ -16,6 +17,23 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def replay_pulses(records):
+    """Запись импульсов из спула. До записи строим маппинг счетчиков по БД, чтобы заменить временные id"""
+    if not mqtt_client.counters_ready and not mqtt_client.initialize_counters():
+        return {'success': False, 'error': 'Counters are not initialized'}
+    return db_manager.add_water_pulses(mqtt_client.resolve_records(records))
+
+
+# Перекачка импульсов, накопленных в спуле, в БД
+spool_replayer = SpoolReplayer(
+    pulse_spool,
+    replay_pulses,
+    batch_size=config.SPOOL_REPLAY_BATCH,
+    retry_min=config.SPOOL_RETRY_MIN,
+    retry_max=config.SPOOL_RETRY_MAX
+)
+
+
 def initialize_system():
     """Инициализация всей системы"""
     try:
@@ -25,11 +43,16 @@ def initialize_system():
         logger.info(f"Connecting to MQTT broker at {config.MQTT_HOST}:{config.MQTT_PORT}")
         mqtt_client.connect()
 
-        # Проверка подключения к БД
+        # Проверка подключения к БД. Без БД стартуем: импульсы пишутся в спул
         logger.info("Testing database connection...")
-        with db_manager.get_session() as session:
-            session.execute(text("SELECT 1"))
-        logger.info("Database connection successful")
+        try:
+            with db_manager.get_session() as session:
+                session.execute(text("SELECT 1"))
+            logger.info("Database connection successful")
+        except Exception as e:
+            logger.warning(f"Database unavailable, pulses will be spooled to {config.SPOOL_DIR}: {e}")
+
+        spool_replayer.start()
 
         logger.info("System initialization complete")
 
@@ -44,7 +67,8 @@ def run_web_server():
     app.run(host='0.0.0.0', port=config.API_PORT, debug=config.DEBUG)
 
 
-if __name__ == '__main__':
+def run():
+    """Запуск системы: MQTT, перекачка спула и веб-сервер"""
     # Инициализация системы
     initialize_system()
 
@@ -54,7 +78,15 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         logger.info("Shutting down system...")
         mqtt_client.disconnect()
+        spool_replayer.stop()
+        pulse_spool.close()
         logger.info("System shutdown complete")
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
-        mqtt_client.disconnect()
\ No newline at end of file
+        mqtt_client.disconnect()
+        spool_replayer.stop()
+        pulse_spool.close()
+
+
+if __name__ == '__main__':
+    run()
@@ -1,18 +1,28 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, create_engine
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, UniqueConstraint, Index, create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from config import config
+import logging
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
-engine = create_engine(config.DATABASE_URL)
+engine = create_engine(config.DATABASE_URL, connect_args={'connect_timeout': config.DB_CONNECT_TIMEOUT})
 
 
 class WaterCounter(Base):
     __tablename__ = 'water_counter'
 
+    __table_args__ = (
+        UniqueConstraint('site', 'name', name='uq_water_counter_site_name'),
+        Index('idx_water_counter_site_group', 'site', 'group_name'),
+    )
+
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False)  # название счетчика
+    site = Column(String(100), nullable=False, default='', server_default='')  # здание/объект
+    group_name = Column(String(100), nullable=False, default='', server_default='')  # стояк/квартира
     value = Column(Float, nullable=False, default=0.0)  # текущее показание в м³
     last_time = Column(DateTime(timezone=True), default=func.now())  # время последнего обновления
 
@@ -23,6 +33,8 @@ class WaterCounter(Base):
         return {
             'id': self.id,
             'name': self.name,
+            'site': self.site,
+            'group_name': self.group_name,
             'value': self.value,
             'last_time': self.last_time.isoformat() if self.last_time else None
         }
@@ -30,6 +42,11 @@ class WaterCounter(Base):
 
 class WaterMeterLog(Base):
     __tablename__ = 'water_meter_log'
+    __table_args__ = (
+        # Покрывает выборки импульсов счетчика за период и историю по времени
+        Index('idx_water_meter_log_sensor_time', 'id_sensor', 'time'),
+        Index('idx_water_meter_log_time', 'time'),
+    )
 
     id = Column(Integer, primary_key=True)
     id_sensor = Column(Integer, ForeignKey('water_counter.id'), nullable=False)  # ссылка на счетчик
@@ -46,5 +63,66 @@ class WaterMeterLog(Base):
         }
 
 
+class SchemaUpgradeError(Exception):
+    """Существующую БД не удалось привести к текущей схеме"""
+
+
+# Приведение существующих БД (созданных до появления site/group_name) к текущей схеме.
+# Все операции идемпотентны. Индексы строятся и удаляются CONCURRENTLY, чтобы не блокировать
+# запись импульсов, поэтому операции выполняются вне транзакции (см. create_schema).
+SCHEMA_UPGRADES = [
+    "ALTER TABLE water_counter ADD COLUMN IF NOT EXISTS site VARCHAR(100) NOT NULL DEFAULT ''",
+    "ALTER TABLE water_counter ADD COLUMN IF NOT EXISTS group_name VARCHAR(100) NOT NULL DEFAULT ''",
+    # Дубликаты имен не дают построить уникальный индекс: все, кроме первого счетчика,
+    # переименовываем в "<имя> #<id>", импульсы остаются у своих счетчиков
+    """
+    UPDATE water_counter SET name = LEFT(name, 88) || ' #' || id
+    WHERE id NOT IN (SELECT MIN(id) FROM water_counter GROUP BY site, name)
+    """,
+    "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_water_counter_site_name ON water_counter (site, name)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_water_counter_site_group ON water_counter (site, group_name)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_water_meter_log_sensor_time ON water_meter_log (id_sensor, time)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_water_meter_log_time ON water_meter_log (time)",
+    # Заменены уникальным и составным индексами выше (имена из postgres/init.sql и из старого дампа init.sql)
+    "DROP INDEX CONCURRENTLY IF EXISTS idx_water_counter_name",
+    "DROP INDEX CONCURRENTLY IF EXISTS idx_water_meter_log_sensor",
+    "DROP INDEX CONCURRENTLY IF EXISTS idx_meter_log_sensor",
+    "DROP INDEX CONCURRENTLY IF EXISTS idx_meter_log_time",
+]
+
+# Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс, который IF NOT EXISTS пропустил бы
+UPGRADE_INDEXES = [
+    'uq_water_counter_site_name',
+    'idx_water_counter_site_group',
+    'idx_water_meter_log_sensor_time',
+    'idx_water_meter_log_time',
+]
+INVALID_INDEXES_QUERY = text("""
+    SELECT c.relname
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE NOT i.indisvalid AND c.relname = ANY(:names)
+""")
+
+
+def create_schema(conn):
+    """
+    Создание таблиц и обновление схемы. conn должен быть в режиме AUTOCOMMIT
+    (CREATE INDEX CONCURRENTLY не выполняется в транзакции).
+    Ошибка обновления прерывает запуск: без уникального индекса не работает создание счетчиков
+    """
+    Base.metadata.create_all(conn)
+    for (name,) in conn.execute(INVALID_INDEXES_QUERY, {'names': UPGRADE_INDEXES}):
+        logger.warning(f"Dropping invalid index {name} left by an interrupted schema upgrade")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    for statement in SCHEMA_UPGRADES:
+        try:
+            conn.execute(text(statement))
+        except Exception as e:
+            raise SchemaUpgradeError(f"Schema upgrade failed: {' '.join(statement.split())}: {e}") from e
+
+
 def init_db():
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    with engine.connect() as conn:
+        create_schema(conn.execution_options(isolation_level='AUTOCOMMIT'))
\ No newline at end of file
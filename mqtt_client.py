@@ -1,7 +1,9 @@
 import paho.mqtt.client as mqtt
 import json
 import logging
+import time
 from database import db_manager
+from spool import pulse_spool, resolve_provisional_ids
 from config import config
 from datetime import datetime
 
@@ -14,32 +16,36 @@ class MQTTClient:
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
 
-        # Маппинг контроллеров к ID счетчиков
-        # Можно настроить через конфиг или базу данных
-        self.controller_mapping = {
-            'water_meter_controller_001': 1,  # Холодная вода
-            'water_meter_controller_002': 2  # Горячая вода
-        }
+        # Контроллеры и их счетчики (config.CONTROLLERS_FILE). Номер контроллера в этом списке -
+        # временный id в спуле до инициализации счетчиков
+        self.controllers = config.CONTROLLERS
+        self._positions = {controller_id: position for position, controller_id in enumerate(self.controllers)}
+        # Маппинг контроллеров к ID счетчиков, строится по БД в initialize_counters
+        self.controller_mapping = {}
+        # Маппинг построен по БД (до этого импульсы пишутся только в спул)
+        self.counters_ready = False
 
         # Создаем счетчики при инициализации если их нет
         self.initialize_counters()
 
     def initialize_counters(self):
-        """Создание счетчиков при запуске если их нет"""
+        """Создание счетчиков если их нет и обновление маппинга. Возвращает True при успехе"""
         try:
-            cold_id = db_manager.create_counter_if_not_exists("Холодная вода")
-            hot_id = db_manager.create_counter_if_not_exists("Горячая вода")
+            counter_ids = db_manager.create_counters_if_not_exist(list(self.controllers.values()))
 
-            # Обновляем маппинг
-            self.controller_mapping = {
-                'water_meter_controller_001': cold_id,
-                'water_meter_controller_002': hot_id
-            }
+            if counter_ids is None:
+                # БД недоступна - импульсы уходят в спул, инициализацию повторит перекачка спула
+                logger.warning("Could not initialize counters, pulses will be spooled until the database is available")
+                return False
 
-            logger.info(f"Initialized counters: Cold={cold_id}, Hot={hot_id}")
+            self.controller_mapping = dict(zip(self.controllers, counter_ids))
+            self.counters_ready = True
+            logger.info(f"Initialized counters for {len(self.controller_mapping)} controllers")
+            return True
 
         except Exception as e:
             logger.error(f"Error initializing counters: {e}")
+            return False
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
@@ -82,32 +88,51 @@ class MQTTClient:
             else:
                 controller_id = data.get('controller_id', 'unknown')
 
-            # Получаем ID счетчика из маппинга
-            counter_id = self.controller_mapping.get(controller_id)
-
-            if not counter_id:
+            if controller_id not in self._positions:
                 logger.error(f"Unknown controller: {controller_id}")
                 return
 
+            if self.counters_ready:
+                counter_id = self.controller_mapping[controller_id]
+            else:
+                # Маппинг еще не построен по БД: пишем в спул временный id,
+                # который заменится на id счетчика при перекачке (resolve_records)
+                counter_id = -(self._positions[controller_id] + 1)
+
             # Получаем количество импульсов (по умолчанию 1)
             pulse_count = data.get('pulse_count', 1)
+            # bool - подкласс int, поэтому true/false из JSON отсекаем явно
+            if (isinstance(pulse_count, bool) or not isinstance(pulse_count, int)
+                    or not 0 < pulse_count <= config.MAX_PULSES_PER_MESSAGE):
+                logger.error(f"Invalid pulse_count from {controller_id}: {pulse_count!r}")
+                return
 
             logger.info(f"Pulse received from {controller_id} (counter {counter_id}): {pulse_count} pulses")
 
-            # Обрабатываем каждый импульс отдельно
-            for i in range(pulse_count):
-                result = db_manager.add_water_pulse(counter_id)
+            # Время фиксируем при получении, чтобы при отложенной записи оно не сдвигалось
+            timestamp = time.time()
 
-                if not result['success']:
-                    logger.error(f"Failed to process pulse: {result.get('error')}")
+            # Пока в спуле есть непереданные импульсы, пишем в него же, чтобы сохранить порядок
+            if self.counters_ready and pulse_spool.is_empty():
+                result = db_manager.add_water_pulses([(counter_id, timestamp, pulse_count)])
+                if result['success']:
+                    pulse_spool.dead_letter(result['rejected'])
+                    logger.info(f"Successfully processed {pulse_count} pulses from {controller_id}")
+                    return
+                logger.warning(f"Database write failed, spooling pulses: {result.get('error')}")
 
-            logger.info(f"Successfully processed {pulse_count} pulses from {controller_id}")
+            pulse_spool.append(counter_id, timestamp, pulse_count)
+            logger.info(f"Spooled {pulse_count} pulses from {controller_id}")
 
         except json.JSONDecodeError as e:
             logger.error(f"Invalid JSON in pulse message: {e}")
         except Exception as e:
             logger.error(f"Error handling pulse message: {e}")
 
+    def resolve_records(self, records):
+        """Замена временных id контроллеров (отрицательных) на id счетчиков из построенного маппинга"""
+        return resolve_provisional_ids(records, [self.controller_mapping[c] for c in self.controllers])
+
     def handle_status_message(self, payload):
         """Обработка статусных сообщений"""
         try:
@@ -1,9 +1,11 @@
-
 CREATE TABLE IF NOT EXISTS water_counter (
     id SERIAL PRIMARY KEY,
     name VARCHAR(100) NOT NULL,
+    site VARCHAR(100) NOT NULL DEFAULT '',        -- здание/объект
+    group_name VARCHAR(100) NOT NULL DEFAULT '',  -- стояк/квартира
     value DECIMAL(10, 3) NOT NULL DEFAULT 0.0,
-    last_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    last_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_water_counter_site_name UNIQUE (site, name)
 );
 
 CREATE TABLE IF NOT EXISTS water_meter_log (
@@ -12,15 +14,15 @@ CREATE TABLE IF NOT EXISTS water_meter_log (
     time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE INDEX IF NOT EXISTS idx_water_meter_log_sensor ON water_meter_log(id_sensor);
+CREATE INDEX IF NOT EXISTS idx_water_meter_log_sensor_time ON water_meter_log(id_sensor, time);
 CREATE INDEX IF NOT EXISTS idx_water_meter_log_time ON water_meter_log(time);
-CREATE INDEX IF NOT EXISTS idx_water_counter_name ON water_counter(name);
+CREATE INDEX IF NOT EXISTS idx_water_counter_site_group ON water_counter(site, group_name);
 
 
 INSERT INTO water_counter (name, value) VALUES
     ('Холодная вода', 125.430),
     ('Горячая вода', 78.920)
-ON CONFLICT (name) DO UPDATE SET
+ON CONFLICT (site, name) DO UPDATE SET
     value = EXCLUDED.value,
     last_time = CURRENT_TIMESTAMP;
 
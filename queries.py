@@ -0,0 +1,192 @@
+from sqlalchemy import select, update, values, column, tuple_, func, Integer, DateTime
+from sqlalchemy.dialects.postgresql import insert
+from models import WaterCounter, WaterMeterLog
+
+# Запросы чтения на уровне SQLAlchemy Core: простые кортежи без ORM-объектов и identity map.
+# Используются и DatabaseManager, и AsyncDatabaseManager.
+# Время в результатах остается datetime - в ISO 8601 его переводит serialization.dumps().
+
+counters = WaterCounter.__table__
+logs = WaterMeterLog.__table__
+
+
+GROUP_COLUMNS = {
+    'site': (counters.c.site,),
+    'group_name': (counters.c.site, counters.c.group_name),
+}
+
+_counter_columns = (
+    counters.c.id, counters.c.name, counters.c.site, counters.c.group_name, counters.c.value, counters.c.last_time
+)
+
+
+def _filter_counters(query, site=None, group_name=None):
+    # Фильтры по зданию и стояку идут по индексу idx_water_counter_site_group;
+    # стояк без здания выбирает одноименные стояки всех зданий
+    if site is not None:
+        query = query.where(counters.c.site == site)
+    if group_name is not None:
+        query = query.where(counters.c.group_name == group_name)
+    return query
+
+
+def current_readings_query(site=None, group_name=None):
+    return _filter_counters(select(*_counter_columns), site, group_name).order_by(counters.c.id)
+
+
+def counter_query(counter_id: int):
+    return select(*_counter_columns).where(counters.c.id == counter_id)
+
+
+def insert_counter_query(name: str, site: str = '', group_name: str = ''):
+    """Вставка счетчика без проверки заранее: при конфликте по (site, name) ничего не возвращает"""
+    return (
+        insert(counters)
+        .values(name=name, site=site, group_name=group_name, value=0.0)
+        .on_conflict_do_nothing(index_elements=[counters.c.site, counters.c.name])
+        .returning(counters.c.id)
+    )
+
+
+def counter_id_query(name: str, site: str = ''):
+    return select(counters.c.id).where(counters.c.site == site, counters.c.name == name)
+
+
+def insert_counters_query(rows):
+    """Вставка счетчиков пачкой (словари name/site/group_name), существующие по (site, name) пропускаются"""
+    return (
+        insert(counters)
+        .values([dict(row, value=0.0) for row in rows])
+        .on_conflict_do_nothing(index_elements=[counters.c.site, counters.c.name])
+    )
+
+
+def counter_ids_query(keys):
+    """id счетчиков по списку пар (site, name)"""
+    return select(counters.c.id, counters.c.site, counters.c.name).where(
+        tuple_(counters.c.site, counters.c.name).in_(keys)
+    )
+
+
+def counter_history_query(counter_id: int, limit: int):
+    return (
+        select(logs.c.id, logs.c.id_sensor, logs.c.time)
+        .where(logs.c.id_sensor == counter_id)
+        .order_by(logs.c.time.desc())
+        .limit(limit)
+    )
+
+
+def pulse_count_query(counter_id: int, start_time, end_time):
+    return select(func.count(logs.c.id)).where(
+        logs.c.id_sensor == counter_id,
+        logs.c.time >= start_time,
+        logs.c.time <= end_time
+    )
+
+
+def _pulses_per_counter(start_time, end_time, site=None, group_name=None):
+    """
+    Подзапрос: импульсы за период, сгруппированные по счетчику.
+    Сначала агрегируем лог, потом соединяем с небольшой таблицей счетчиков;
+    при фильтре по зданию или стояку лог читается по idx_water_meter_log_sensor_time только для его счетчиков.
+    """
+    query = select(logs.c.id_sensor, func.count().label('pulses')).where(
+        logs.c.time >= start_time,
+        logs.c.time <= end_time
+    )
+    if site is not None or group_name is not None:
+        query = query.where(logs.c.id_sensor.in_(_filter_counters(select(counters.c.id), site, group_name)))
+    return query.group_by(logs.c.id_sensor).subquery('pulses_per_counter')
+
+
+def all_consumption_query(start_time, end_time, site=None, group_name=None):
+    """Количество импульсов за период по всем счетчикам одним запросом"""
+    pulses = _pulses_per_counter(start_time, end_time, site, group_name)
+    query = (
+        select(counters.c.id, counters.c.name, counters.c.value, func.coalesce(pulses.c.pulses, 0))
+        .select_from(counters.outerjoin(pulses, pulses.c.id_sensor == counters.c.id))
+    )
+    return _filter_counters(query, site, group_name).order_by(counters.c.id)
+
+
+def group_consumption_query(start_time, end_time, group_by='site', site=None):
+    """Количество счетчиков и импульсов за период по зданиям (group_by='site') или стоякам ('group_name')"""
+    columns = GROUP_COLUMNS[group_by]
+    pulses = _pulses_per_counter(start_time, end_time, site)
+    query = (
+        select(*columns, func.count(counters.c.id), func.coalesce(func.sum(pulses.c.pulses), 0))
+        .select_from(counters.outerjoin(pulses, pulses.c.id_sensor == counters.c.id))
+    )
+    return _filter_counters(query, site).group_by(*columns).order_by(*columns)
+
+
+def counter_rows_to_dicts(rows):
+    return [
+        {
+            'id': counter_id,
+            'name': name,
+            'site': site,
+            'group_name': group_name,
+            'value': value,
+            'last_time': last_time
+        }
+        for counter_id, name, site, group_name, value, last_time in rows
+    ]
+
+
+def history_rows_to_dicts(rows):
+    return [
+        {'id': log_id, 'id_sensor': id_sensor, 'time': time}
+        for log_id, id_sensor, time in rows
+    ]
+
+
+def consumption_rows_to_dicts(rows):
+    # Расход = количество импульсов * 0.01 м³
+    return [
+        {
+            'counter_id': counter_id,
+            'counter_name': name,
+            'pulse_count': pulse_count,
+            'consumption_m3': pulse_count * 0.01,
+            'consumption_liters': pulse_count * 10.0,
+            'current_value': value
+        }
+        for counter_id, name, value, pulse_count in rows
+    ]
+
+
+def group_rows_to_dicts(rows):
+    results = []
+    for row in rows:
+        *keys, counter_count, pulse_count = row
+        item = dict(zip(('site', 'group_name'), keys))
+        item.update({
+            'counter_count': counter_count,
+            'pulse_count': int(pulse_count),
+            'consumption_m3': int(pulse_count) * 0.01,
+            'consumption_liters': int(pulse_count) * 10.0
+        })
+        results.append(item)
+    return results
+
+
+def add_pulses_query(totals):
+    """
+    Увеличение показаний счетчиков одним UPDATE ... FROM (VALUES ...) (каждый импульс = 0.01 м³).
+    totals - список (counter_id, pulse_count, last_time). Возвращает id найденных счетчиков
+    """
+    data = values(
+        column('id', Integer), column('pulses', Integer), column('last_time', DateTime(timezone=True)),
+        name='totals'
+    ).data(totals)
+    return (
+        update(counters)
+        .where(counters.c.id == data.c.id)
+        .values(
+            value=counters.c.value + data.c.pulses * 0.01,
+            last_time=func.greatest(counters.c.last_time, data.c.last_time)
+        )
+        .returning(counters.c.id)
+    )
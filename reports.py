@@ -0,0 +1,231 @@
+import logging
+import numpy as np
+import pandas as pd
+from models import engine
+from config import config
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Каждый импульс = 10 литров
+PULSE_LITERS = 10.0
+# Сколько частичных агрегатов копить перед их слиянием
+MAX_PARTIAL_AGGREGATES = 32
+# Импульсы сначала группируются по 15 минутам unix time: смещения часовых поясов
+# кратны 15 минутам, поэтому интервалы целиком попадают в локальный час (в том числе для +05:30)
+BUCKET_SECONDS = 900
+# Виды отчетов для ConsumptionReports.build
+REPORT_KINDS = ('daily', 'heatmap', 'percentiles', 'monthly', 'summary')
+
+
+class ConsumptionReports:
+    """
+    Статистика расхода по логу импульсов.
+    Импульсы читаются курсором на стороне сервера пачками по chunk_size строк,
+    каждая пачка сразу сворачивается в почасовые суммы по счетчикам,
+    поэтому память ограничена числом часов в периоде, а не числом импульсов.
+    """
+
+    def __init__(self, engine, chunk_size=100000, timezone='UTC'):
+        self.engine = engine
+        self.chunk_size = chunk_size
+        self.timezone = timezone
+
+    def load_hourly_pulses(self, start_time: datetime, end_time: datetime, counter_ids=None):
+        """
+        Количество импульсов по счетчикам и часам за период [start_time, end_time).
+        Возвращает Series с индексом (counter_id, hour), hour - начало часа в self.timezone
+        """
+        query = """
+            SELECT id_sensor, EXTRACT(EPOCH FROM time)::float8
+            FROM water_meter_log
+            WHERE time >= %(start_time)s AND time < %(end_time)s
+        """
+        params = {
+            'start_time': self._localize(start_time).to_pydatetime(),
+            'end_time': self._localize(end_time).to_pydatetime()
+        }
+        if counter_ids:
+            query += " AND id_sensor = ANY(%(counter_ids)s)"
+            params['counter_ids'] = list(counter_ids)
+
+        partials = []
+        total_rows = 0
+        # Именованный курсор psycopg2 - курсор на стороне сервера, строки приходят пачками
+        # в виде простых кортежей без обертки Row, что позволяет сразу собрать numpy-массив
+        with self.engine.connect() as conn:
+            cursor = conn.connection.dbapi_connection.cursor(name='report_pulses')
+            try:
+                cursor.itersize = self.chunk_size
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(self.chunk_size)
+                    if not rows:
+                        break
+                    chunk = np.array(rows, dtype=np.float64)
+                    total_rows += len(chunk)
+
+                    keys = pd.MultiIndex.from_arrays(
+                        [chunk[:, 0].astype(np.int64), (chunk[:, 1] // BUCKET_SECONDS).astype(np.int64)],
+                        names=['counter_id', 'bucket']
+                    )
+                    partials.append(pd.Series(1, index=keys).groupby(level=[0, 1]).sum())
+
+                    if len(partials) >= MAX_PARTIAL_AGGREGATES:
+                        partials = [pd.concat(partials).groupby(level=[0, 1]).sum()]
+            finally:
+                cursor.close()
+
+        logger.info(f"Loaded {total_rows} pulses for report {start_time} - {end_time}")
+
+        if not partials:
+            empty = pd.MultiIndex.from_arrays(
+                [np.array([], dtype=np.int64), pd.DatetimeIndex([], tz=self.timezone)],
+                names=['counter_id', 'hour']
+            )
+            return pd.Series([], index=empty, dtype=np.int64)
+
+        buckets = pd.concat(partials).groupby(level=[0, 1]).sum()
+        # Начало локального часа: из начала интервала в self.timezone вычитаем его минуты
+        starts = pd.to_datetime(
+            buckets.index.get_level_values('bucket') * BUCKET_SECONDS, unit='s', utc=True
+        ).tz_convert(self.timezone)
+        hours = starts - pd.to_timedelta(starts.minute, unit='m')
+        buckets.index = pd.MultiIndex.from_arrays(
+            [buckets.index.get_level_values('counter_id'), hours],
+            names=['counter_id', 'hour']
+        )
+        return buckets.groupby(level=[0, 1]).sum()
+
+    def daily_profile(self, hourly, start_time: datetime, end_time: datetime):
+        """Расход в литрах по дням (строки) и счетчикам (столбцы), дни без расхода заполнены нулями"""
+        days = self._days(start_time, end_time)
+        if hourly.empty:
+            return pd.DataFrame(index=days, dtype=np.float64)
+
+        hours = hourly.index.get_level_values('hour')
+        daily = hourly.groupby([hourly.index.get_level_values('counter_id'), hours.normalize()]).sum()
+        return daily.unstack(level=0, fill_value=0).reindex(days, fill_value=0) * PULSE_LITERS
+
+    def hourly_heatmap(self, hourly, start_time: datetime, end_time: datetime):
+        """
+        Средний расход в литрах по дням недели (0 - понедельник) и часам суток.
+        Возвращает {counter_id: матрица 7x24}
+        """
+        # Сколько раз каждый день недели встречается в периоде - делитель для среднего
+        days = self._days(start_time, end_time)
+        weekday_counts = np.bincount(days.dayofweek, minlength=7).astype(np.float64)
+        weekday_counts[weekday_counts == 0] = 1.0
+
+        result = {}
+        counter_ids = hourly.index.get_level_values('counter_id')
+        hours = hourly.index.get_level_values('hour')
+        for counter_id in np.unique(counter_ids):
+            mask = counter_ids == counter_id
+            matrix = np.zeros((7, 24), dtype=np.float64)
+            np.add.at(matrix, (hours[mask].dayofweek, hours[mask].hour), hourly.values[mask])
+            result[int(counter_id)] = (matrix * PULSE_LITERS / weekday_counts[:, None]).round(2).tolist()
+        return result
+
+    def percentiles(self, daily, quantiles=(50, 90, 95, 99)):
+        """Перцентили суточного расхода (литры) по каждому счетчику"""
+        result = {}
+        if daily.empty:
+            return result
+
+        values = np.percentile(daily.to_numpy(), quantiles, axis=0)
+        for position, counter_id in enumerate(daily.columns):
+            column = daily[counter_id]
+            stats = {f"p{q:g}": round(float(values[i][position]), 2) for i, q in enumerate(quantiles)}
+            stats.update({
+                'mean': round(float(column.mean()), 2),
+                'max': round(float(column.max()), 2),
+                'days': int(len(column)),
+                'days_with_usage': int((column > 0).sum())
+            })
+            result[int(counter_id)] = stats
+        return result
+
+    def monthly(self, daily):
+        """Расход по месяцам и изменение относительно предыдущего месяца в процентах"""
+        result = {}
+        if daily.empty:
+            return result
+
+        months = daily.groupby(daily.index.strftime('%Y-%m')).sum()
+        change = months.pct_change() * 100
+        change = change.replace([np.inf, -np.inf], np.nan)
+
+        for counter_id in months.columns:
+            result[int(counter_id)] = [
+                {
+                    'month': month,
+                    'liters': round(float(liters), 2),
+                    'cubic_meters': round(float(liters) / 1000, 3),
+                    'change_percent': None if pd.isna(delta) else round(float(delta), 1)
+                }
+                for month, liters, delta in zip(months.index, months[counter_id], change[counter_id])
+            ]
+        return result
+
+    def build(self, kind: str, start_time: datetime, end_time: datetime, counter_ids=None, quantiles=None):
+        """
+        Построение отчета.
+        kind: daily | heatmap | percentiles | monthly | summary
+        """
+        hourly = self.load_hourly_pulses(start_time, end_time, counter_ids)
+        daily = self.daily_profile(hourly, start_time, end_time)
+
+        report = {}
+        if kind in ('daily', 'summary'):
+            report['daily'] = {
+                int(counter_id): [
+                    {'date': day.date().isoformat(), 'liters': round(float(liters), 2)}
+                    for day, liters in daily[counter_id].items()
+                ]
+                for counter_id in daily.columns
+            }
+        if kind in ('heatmap', 'summary'):
+            report['heatmap'] = self.hourly_heatmap(hourly, start_time, end_time)
+        if kind in ('percentiles', 'summary'):
+            report['percentiles'] = self.percentiles(daily, quantiles or (50, 90, 95, 99))
+        if kind in ('monthly', 'summary'):
+            report['monthly'] = self.monthly(daily)
+
+        return report
+
+    def parse_period(self, start: str = None, end: str = None, default_days: int = 30):
+        """
+        Период отчета из строк ISO 8601, по умолчанию - последние default_days дней.
+        Время без часового пояса считается заданным в self.timezone, поэтому значения
+        с поясом и без него можно смешивать. Неверный формат - ValueError
+        """
+        end_time = self._parse_time(end) if end else pd.Timestamp.now(tz=self.timezone)
+        start_time = self._parse_time(start) if start else end_time - pd.Timedelta(days=default_days)
+        return start_time.to_pydatetime(), end_time.to_pydatetime()
+
+    def _parse_time(self, value: str):
+        return self._localize(datetime.fromisoformat(value.replace('Z', '+00:00')))
+
+    def _days(self, start_time: datetime, end_time: datetime):
+        """Календарные дни периода [start_time, end_time) в self.timezone"""
+        return pd.date_range(
+            self._localize(start_time).normalize(),
+            (self._localize(end_time) - pd.Timedelta(microseconds=1)).normalize(),
+            freq='D'
+        )
+
+    def _localize(self, value: datetime):
+        """Время без часового пояса считается заданным в self.timezone"""
+        timestamp = pd.Timestamp(value)
+        if timestamp.tzinfo is None:
+            return timestamp.tz_localize(self.timezone)
+        return timestamp.tz_convert(self.timezone)
+
+
+# Глобальный экземпляр
+consumption_reports = ConsumptionReports(
+    engine,
+    chunk_size=config.REPORT_CHUNK_SIZE,
+    timezone=config.REPORT_TIMEZONE
+)
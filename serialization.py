@@ -0,0 +1,38 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # orjson не установлен - используем стандартный json
+    orjson = None
+
+
+def _default(value):
+    """Типы, которые не умеет сериализовать json/orjson"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj, sort_keys=False) -> bytes:
+    """
+    Быстрая сериализация в JSON.
+    С orjson время (datetime) форматируется в ISO 8601 внутри энкодера на C,
+    поэтому строки из БД можно отдавать без isoformat() на каждую запись.
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_default, option=option)
+    return dumps(obj, sort_keys=sort_keys).encode('utf-8')
+
+
+def dumps(obj, sort_keys=False) -> str:
+    if orjson is not None:
+        return dumps_bytes(obj, sort_keys=sort_keys).decode('utf-8')
+    return json.dumps(obj, default=_default, ensure_ascii=False, sort_keys=sort_keys, separators=(',', ':'))
+
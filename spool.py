@@ -0,0 +1,500 @@
+import asyncio
+import errno
+import os
+import struct
+import threading
+import time
+import logging
+from collections import OrderedDict
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Запись спула: id счетчика, время импульса (unix time), количество импульсов
+RECORD = struct.Struct('<idI')
+SEGMENT_SUFFIX = '.seg'
+OFFSET_FILE = 'offset'
+# Записи, которые БД отвергла (неизвестный счетчик): не перекачиваются, но и не теряются
+DEAD_LETTER_FILE = 'dead_letter'
+FSYNC_POLICIES = ('always', 'interval', 'never')
+# Минимальный период проверки fsync по таймеру, секунды
+MIN_SYNC_PERIOD = 0.1
+
+
+def write_all(fd, data, size):
+    """
+    Дозапись data в конец файла, в котором уже size байт.
+    os.write может записать данные не целиком (например, на заполненном диске): дописываем остаток,
+    а при ошибке обрезаем файл до size, чтобы следующие записи не сместились
+    """
+    view = memoryview(data)
+    try:
+        while view:
+            written = os.write(fd, view)
+            if written == 0:
+                raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+            view = view[written:]
+    except OSError:
+        os.ftruncate(fd, size)
+        raise
+
+
+def resolve_provisional_ids(records, counter_ids):
+    """
+    Замена временных id на id счетчиков. Временный id -n записывается в спул до инициализации
+    счетчиков и означает n-й контроллер; ему соответствует counter_ids[n - 1]
+    """
+    return [
+        (counter_ids[-counter_id - 1] if -len(counter_ids) <= counter_id < 0 else counter_id, timestamp, pulse_count)
+        for counter_id, timestamp, pulse_count in records
+    ]
+
+
+class SpoolBatch:
+    """Пачка записей, прочитанных из спула, и позиция для подтверждения"""
+
+    def __init__(self, records, position):
+        self.records = records
+        self.position = position
+        self.started = time.monotonic()
+
+    def __len__(self):
+        return len(self.records)
+
+
+class PulseSpool:
+    """
+    Локальный append-only спул импульсов.
+    Данные пишутся в сегментные файлы фиксированного формата,
+    позиция чтения хранится в отдельном файле и переживает перезапуск.
+    """
+
+    def __init__(self, directory, fsync_policy='interval', fsync_interval=1.0,
+                 segment_bytes=4 * 1024 * 1024, max_bytes=256 * 1024 * 1024,
+                 dead_letter_max_bytes=16 * 1024 * 1024):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync_policy}', expected one of {FSYNC_POLICIES}")
+
+        self.directory = directory
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        # Размеры выравниваем по длине записи, чтобы запись не разрывалась между сегментами
+        self.segment_bytes = max(RECORD.size, segment_bytes - segment_bytes % RECORD.size)
+        self.max_bytes = max(self.segment_bytes, max_bytes)
+        self.dead_letter_max_bytes = dead_letter_max_bytes
+
+        self._lock = threading.Lock()
+        self._segments = OrderedDict()  # seq -> размер сегмента в байтах
+        self._read_pos = (0, 0)  # (seq, offset)
+        self._fd = None
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+        self._dead_letter_bytes = 0
+
+        # Метрики
+        self.appended_records = 0
+        self.replayed_records = 0
+        self.dropped_records = 0
+        self.dead_letter_records = 0
+        self.dead_letter_dropped = 0
+        self.replay_rate = 0.0
+        self.last_replay_time = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    # ---- служебные методы ----
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}{SEGMENT_SUFFIX}")
+
+    def _load(self):
+        """Восстановление состояния спула с диска"""
+        seqs = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+        )
+
+        for seq in seqs:
+            path = self._segment_path(seq)
+            size = os.path.getsize(path)
+            torn = size % RECORD.size
+            if torn:
+                # Обрезаем недописанную запись после аварийного завершения
+                logger.warning(f"Truncating {torn} torn bytes in spool segment {path}")
+                size -= torn
+                os.truncate(path, size)
+            self._segments[seq] = size
+
+        offset_path = os.path.join(self.directory, OFFSET_FILE)
+        if os.path.exists(offset_path):
+            try:
+                with open(offset_path) as f:
+                    seq, offset = (int(part) for part in f.read().split())
+                self._read_pos = (seq, offset - offset % RECORD.size)
+            except ValueError as e:
+                logger.error(f"Corrupted spool offset file, replaying from the beginning: {e}")
+
+        if self._segments and self._read_pos[0] < next(iter(self._segments)):
+            self._read_pos = (next(iter(self._segments)), 0)
+
+        self._remove_consumed_segments()
+
+        if not self._segments:
+            self._read_pos = (max(self._read_pos[0], 1), 0)
+            self._segments[self._read_pos[0]] = 0
+        self._open_active()
+
+        dead_letter_path = os.path.join(self.directory, DEAD_LETTER_FILE)
+        if os.path.exists(dead_letter_path):
+            self._dead_letter_bytes = os.path.getsize(dead_letter_path)
+            torn = self._dead_letter_bytes % RECORD.size
+            if torn:
+                logger.warning(f"Truncating {torn} torn bytes in spool dead letter file {dead_letter_path}")
+                self._dead_letter_bytes -= torn
+                os.truncate(dead_letter_path, self._dead_letter_bytes)
+            self.dead_letter_records = self._dead_letter_bytes // RECORD.size
+            logger.warning(f"Spool {self.directory} has {self.dead_letter_records} dead letter records "
+                           f"in {dead_letter_path}")
+
+        pending = self.pending_records()
+        if pending:
+            logger.info(f"Spool {self.directory} has {pending} pending records to replay")
+
+    def _open_active(self):
+        seq = next(reversed(self._segments))
+        self._fd = os.open(self._segment_path(seq), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if self.fsync_policy == 'always':
+            self._fsync_directory()
+
+    def _fsync_directory(self):
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _sync(self, force=False):
+        if not self._dirty or self.fsync_policy == 'never':
+            return
+        now = time.monotonic()
+        if force or self.fsync_policy == 'always' or now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._fd)
+            self._last_fsync = now
+            self._dirty = False
+
+    def _rotate(self):
+        """Закрытие активного сегмента и открытие следующего"""
+        self._sync(force=True)
+        os.close(self._fd)
+        self._segments[next(reversed(self._segments)) + 1] = 0
+        self._open_active()
+
+    def _enforce_limit(self, incoming):
+        """Ограничение размера спула: при переполнении удаляются самые старые сегменты"""
+        while sum(self._segments.values()) + incoming > self.max_bytes:
+            if len(self._segments) == 1:
+                self._rotate()
+            seq, size = next(iter(self._segments.items()))
+            read_seq, read_offset = self._read_pos
+            lost = (size - read_offset) // RECORD.size if seq == read_seq else size // RECORD.size
+            self.dropped_records += lost
+            del self._segments[seq]
+            os.remove(self._segment_path(seq))
+            self._read_pos = max(self._read_pos, (next(iter(self._segments)), 0))
+            logger.error(f"Spool size limit {self.max_bytes} bytes reached, dropped {lost} oldest records")
+
+    def _remove_consumed_segments(self):
+        active_seq = next(reversed(self._segments), None)
+        for seq in list(self._segments):
+            if seq >= self._read_pos[0] or seq == active_seq:
+                break
+            del self._segments[seq]
+            os.remove(self._segment_path(seq))
+
+    def _save_offset(self):
+        path = os.path.join(self.directory, OFFSET_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(f"{self._read_pos[0]} {self._read_pos[1]}")
+            if self.fsync_policy != 'never':
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    # ---- публичный интерфейс ----
+
+    def append(self, counter_id: int, timestamp: float, pulse_count: int = 1):
+        """Добавление импульсов в спул"""
+        data = RECORD.pack(counter_id, timestamp, pulse_count)
+        with self._lock:
+            self._enforce_limit(len(data))
+            active_seq = next(reversed(self._segments))
+            if self._segments[active_seq] + len(data) > self.segment_bytes:
+                self._rotate()
+                active_seq = next(reversed(self._segments))
+
+            write_all(self._fd, data, self._segments[active_seq])
+            self._segments[active_seq] += len(data)
+            self._dirty = True
+            self._sync()
+            self.appended_records += 1
+
+    def dead_letter(self, records):
+        """
+        Сохранение записей, которые нельзя записать в БД (например, счетчик не найден).
+        Формат тот же, что у сегментов; после исправления причины их можно перекачать вручную.
+        Размер файла ограничен dead_letter_max_bytes, записи сверх лимита отбрасываются
+        """
+        if not records:
+            return
+        with self._lock:
+            free = max(0, self.dead_letter_max_bytes - self._dead_letter_bytes) // RECORD.size
+            dropped = len(records) - free
+            if dropped > 0:
+                self.dead_letter_dropped += dropped
+                logger.error(f"Spool dead letter limit {self.dead_letter_max_bytes} bytes reached, "
+                             f"dropped {dropped} records")
+                records = records[:free]
+            if not records:
+                return
+
+            data = b''.join(RECORD.pack(*record) for record in records)
+            fd = os.open(os.path.join(self.directory, DEAD_LETTER_FILE), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                write_all(fd, data, self._dead_letter_bytes)
+                if self.fsync_policy != 'never':
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._dead_letter_bytes += len(data)
+            self.dead_letter_records += len(records)
+        logger.error(f"Moved {len(records)} records to spool dead letter file")
+
+    def read_batch(self, max_records: int) -> SpoolBatch:
+        """Чтение до max_records записей начиная с текущей позиции (без подтверждения)"""
+        records = []
+        with self._lock:
+            seq, offset = self._read_pos
+            for segment_seq, size in self._segments.items():
+                if segment_seq < seq:
+                    continue
+                if segment_seq > seq:
+                    seq, offset = segment_seq, 0
+                need = (max_records - len(records)) * RECORD.size
+                length = min(size - offset, need)
+                if length > 0:
+                    with open(self._segment_path(seq), 'rb') as f:
+                        f.seek(offset)
+                        chunk = f.read(length)
+                    records.extend(RECORD.iter_unpack(chunk))
+                    offset += len(chunk)
+                if len(records) >= max_records:
+                    break
+        return SpoolBatch(records, (seq, offset))
+
+    def commit(self, batch: SpoolBatch):
+        """Подтверждение успешной записи пачки в БД"""
+        if not batch.records:
+            return
+        with self._lock:
+            self._read_pos = max(self._read_pos, batch.position)
+            self._save_offset()
+            self._remove_consumed_segments()
+
+            elapsed = time.monotonic() - batch.started
+            self.replayed_records += len(batch)
+            self.replay_rate = len(batch) / elapsed if elapsed > 0 else float(len(batch))
+            self.last_replay_time = time.time()
+
+    def sync(self):
+        """fsync дописанных записей, если истек fsync_interval. Вызывается по таймеру из перекачки"""
+        with self._lock:
+            if self._fd is not None:
+                self._sync()
+
+    def pending_bytes(self) -> int:
+        with self._lock:
+            return self._pending_bytes()
+
+    def _pending_bytes(self):
+        seq, offset = self._read_pos
+        return sum(size for s, size in self._segments.items() if s >= seq) - offset
+
+    def pending_records(self) -> int:
+        return self.pending_bytes() // RECORD.size
+
+    def is_empty(self) -> bool:
+        return self.pending_bytes() == 0
+
+    def get_stats(self):
+        """Метрики спула"""
+        with self._lock:
+            pending_bytes = self._pending_bytes()
+            return {
+                'directory': self.directory,
+                'fsync_policy': self.fsync_policy,
+                'size_bytes': sum(self._segments.values()),
+                'max_bytes': self.max_bytes,
+                'segments': len(self._segments),
+                'pending_records': pending_bytes // RECORD.size,
+                'appended_records': self.appended_records,
+                'replayed_records': self.replayed_records,
+                'dropped_records': self.dropped_records,
+                'dead_letter_records': self.dead_letter_records,
+                'dead_letter_dropped': self.dead_letter_dropped,
+                'replay_rate': round(self.replay_rate, 1),
+                'last_replay_time': self.last_replay_time
+            }
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                self._sync(force=True)
+                os.close(self._fd)
+                self._fd = None
+
+
+class SpoolReplayer:
+    """
+    Фоновая перекачка спула в БД большими пачками.
+    sink(records) должен возвращать словарь с ключом 'success', как методы DatabaseManager,
+    и список 'rejected' с записями, которые БД не приняла - они уходят в dead letter.
+    При ошибке повтор выполняется с экспоненциальной задержкой.
+    """
+
+    def __init__(self, spool: PulseSpool, sink, batch_size=5000, retry_min=1.0, retry_max=60.0):
+        self.spool = spool
+        self.sink = sink
+        self.batch_size = batch_size
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='spool-replayer', daemon=True)
+        self._thread.start()
+        logger.info("Spool replayer started")
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        logger.info("Spool replayer stopped")
+
+    def _run(self):
+        delay = self.retry_min
+        while not self._stop.is_set():
+            # Ошибки диска (например, ENOSPC при сохранении смещения) не должны останавливать перекачку:
+            # пачка повторяется с той же задержкой, что и при ошибке БД
+            try:
+                batch = self.spool.read_batch(self.batch_size)
+                if not batch.records:
+                    self._wait(self.retry_min)
+                    continue
+
+                try:
+                    result = self.sink(batch.records)
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+
+                if result.get('success'):
+                    self.spool.dead_letter(result.get('rejected'))
+                    self.spool.commit(batch)
+                    delay = self.retry_min
+                    logger.info(f"Replayed {len(batch)} spooled records, {self.spool.pending_records()} pending")
+                    continue
+                error = result.get('error')
+            except Exception as e:
+                error = f"spool error: {e}"
+
+            logger.warning(f"Spool replay failed, retrying in {delay:.0f}s: {error}")
+            self._wait(delay)
+            delay = min(delay * 2, self.retry_max)
+
+    def _wait(self, seconds):
+        """Ожидание, во время которого спул синхронизируется на диск не реже fsync_interval"""
+        deadline = time.monotonic() + seconds
+        while not self._stop.is_set():
+            try:
+                self.spool.sync()
+            except OSError as e:
+                logger.error(f"Spool fsync failed: {e}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self._stop.wait(min(remaining, max(self.spool.fsync_interval, MIN_SYNC_PERIOD)))
+
+
+class AsyncSpoolReplayer:
+    """
+    Перекачка спула в БД для асинхронного режима.
+    sink(records) - корутина, возвращающая словарь с ключами 'success' и 'rejected'.
+    """
+
+    def __init__(self, spool: PulseSpool, sink, batch_size=5000, retry_min=1.0, retry_max=60.0):
+        self.spool = spool
+        self.sink = sink
+        self.batch_size = batch_size
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+
+    async def run(self):
+        logger.info("Async spool replayer started")
+        delay = self.retry_min
+        while True:
+            # Ошибки диска не должны завершать задачу (и вместе с ней весь сервис)
+            try:
+                batch = await asyncio.to_thread(self.spool.read_batch, self.batch_size)
+                if not batch.records:
+                    await self._wait(self.retry_min)
+                    continue
+
+                try:
+                    result = await self.sink(batch.records)
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+
+                if result.get('success'):
+                    await asyncio.to_thread(self.spool.dead_letter, result.get('rejected'))
+                    await asyncio.to_thread(self.spool.commit, batch)
+                    delay = self.retry_min
+                    pending = await asyncio.to_thread(self.spool.pending_records)
+                    logger.info(f"Replayed {len(batch)} spooled records, {pending} pending")
+                    continue
+                error = result.get('error')
+            except Exception as e:
+                error = f"spool error: {e}"
+
+            logger.warning(f"Spool replay failed, retrying in {delay:.0f}s: {error}")
+            await self._wait(delay)
+            delay = min(delay * 2, self.retry_max)
+
+    async def _wait(self, seconds):
+        """Ожидание, во время которого спул синхронизируется на диск не реже fsync_interval"""
+        deadline = time.monotonic() + seconds
+        while True:
+            try:
+                await asyncio.to_thread(self.spool.sync)
+            except OSError as e:
+                logger.error(f"Spool fsync failed: {e}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, max(self.spool.fsync_interval, MIN_SYNC_PERIOD)))
+
+
+# Глобальный экземпляр
+pulse_spool = PulseSpool(
+    config.SPOOL_DIR,
+    fsync_policy=config.SPOOL_FSYNC,
+    fsync_interval=config.SPOOL_FSYNC_INTERVAL,
+    segment_bytes=config.SPOOL_SEGMENT_BYTES,
+    max_bytes=config.SPOOL_MAX_BYTES,
+    dead_letter_max_bytes=config.SPOOL_DEAD_LETTER_MAX_BYTES
+)
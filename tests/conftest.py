@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Глобальный pulse_spool создается при импорте spool - направляем его во временный каталог
+os.environ.setdefault('SPOOL_DIR', tempfile.mkdtemp(prefix='spool-tests-'))
@@ -0,0 +1,187 @@
+import os
+import errno
+
+import pytest
+
+import spool
+from spool import PulseSpool, RECORD, DEAD_LETTER_FILE, resolve_provisional_ids
+
+
+def make_spool(directory, **kwargs):
+    kwargs.setdefault('fsync_policy', 'never')
+    return PulseSpool(str(directory), **kwargs)
+
+
+def replay_all(pulse_spool, batch_size=100):
+    records = []
+    while True:
+        batch = pulse_spool.read_batch(batch_size)
+        if not batch.records:
+            return records
+        records.extend(batch.records)
+        pulse_spool.commit(batch)
+
+
+def test_append_read_commit(tmp_path):
+    pulse_spool = make_spool(tmp_path)
+    for i in range(5):
+        pulse_spool.append(1, 1000.0 + i, i + 1)
+
+    batch = pulse_spool.read_batch(3)
+    assert batch.records == [(1, 1000.0, 1), (1, 1001.0, 2), (1, 1002.0, 3)]
+    # Без commit пачка читается повторно
+    assert pulse_spool.read_batch(3).records == batch.records
+
+    pulse_spool.commit(batch)
+    assert pulse_spool.pending_records() == 2
+    assert replay_all(pulse_spool) == [(1, 1003.0, 4), (1, 1004.0, 5)]
+    assert pulse_spool.is_empty()
+
+
+def test_restart_keeps_uncommitted_records(tmp_path):
+    pulse_spool = make_spool(tmp_path)
+    for i in range(4):
+        pulse_spool.append(2, float(i), 1)
+    pulse_spool.commit(pulse_spool.read_batch(1))
+    pulse_spool.close()
+
+    reopened = make_spool(tmp_path)
+    assert reopened.pending_records() == 3
+    assert [r[1] for r in replay_all(reopened)] == [1.0, 2.0, 3.0]
+
+
+def test_restart_after_crash_truncates_torn_record(tmp_path):
+    pulse_spool = make_spool(tmp_path)
+    pulse_spool.append(1, 1.0, 1)
+    pulse_spool.append(1, 2.0, 1)
+    pulse_spool.close()
+
+    # Аварийное завершение посреди записи: в сегменте половина записи
+    segment = next(name for name in os.listdir(tmp_path) if name.endswith('.seg'))
+    with open(tmp_path / segment, 'ab') as f:
+        f.write(RECORD.pack(1, 3.0, 1)[:RECORD.size // 2])
+
+    reopened = make_spool(tmp_path)
+    assert os.path.getsize(tmp_path / segment) == 2 * RECORD.size
+    reopened.append(1, 4.0, 1)
+    assert replay_all(reopened) == [(1, 1.0, 1), (1, 2.0, 1), (1, 4.0, 1)]
+
+
+def test_segments_rotate_and_consumed_segments_are_removed(tmp_path):
+    pulse_spool = make_spool(tmp_path, segment_bytes=4 * RECORD.size)
+    for i in range(10):
+        pulse_spool.append(1, float(i), 1)
+    assert pulse_spool.get_stats()['segments'] == 3
+
+    assert [r[1] for r in replay_all(pulse_spool, batch_size=3)] == [float(i) for i in range(10)]
+    # Остается только активный сегмент
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.seg')]) == 1
+
+
+def test_overflow_drops_oldest_records_of_partly_read_segment(tmp_path):
+    pulse_spool = make_spool(tmp_path, segment_bytes=4 * RECORD.size, max_bytes=8 * RECORD.size)
+    for i in range(8):
+        pulse_spool.append(1, float(i), 1)
+    # Первый сегмент прочитан наполовину
+    pulse_spool.commit(pulse_spool.read_batch(2))
+
+    pulse_spool.append(1, 8.0, 1)
+
+    stats = pulse_spool.get_stats()
+    assert stats['dropped_records'] == 2
+    assert stats['size_bytes'] <= 8 * RECORD.size
+    assert [r[1] for r in replay_all(pulse_spool)] == [4.0, 5.0, 6.0, 7.0, 8.0]
+
+
+def test_short_write_is_completed(tmp_path, monkeypatch):
+    pulse_spool = make_spool(tmp_path)
+    real_write = os.write
+
+    def short_write(fd, data):
+        return real_write(fd, bytes(data[:5]))
+
+    monkeypatch.setattr(spool.os, 'write', short_write)
+    pulse_spool.append(1, 1.0, 1)
+    pulse_spool.append(2, 2.0, 3)
+    monkeypatch.undo()
+
+    assert replay_all(pulse_spool) == [(1, 1.0, 1), (2, 2.0, 3)]
+
+
+def test_failed_write_does_not_misalign_records(tmp_path, monkeypatch):
+    pulse_spool = make_spool(tmp_path)
+    pulse_spool.append(1, 1.0, 1)
+    real_write = os.write
+    calls = []
+
+    def write_then_fail(fd, data):
+        calls.append(len(data))
+        if len(calls) == 1:
+            return real_write(fd, bytes(data[:5]))
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr(spool.os, 'write', write_then_fail)
+    with pytest.raises(OSError):
+        pulse_spool.append(1, 2.0, 1)
+    monkeypatch.undo()
+
+    pulse_spool.append(1, 3.0, 1)
+    assert replay_all(pulse_spool) == [(1, 1.0, 1), (1, 3.0, 1)]
+
+
+def test_dead_letter_is_persisted_and_bounded(tmp_path):
+    pulse_spool = make_spool(tmp_path, dead_letter_max_bytes=3 * RECORD.size)
+    pulse_spool.dead_letter([(7, 1.0, 1), (7, 2.0, 2)])
+    pulse_spool.dead_letter([(8, 3.0, 1), (8, 4.0, 1)])
+
+    stats = pulse_spool.get_stats()
+    assert stats['dead_letter_records'] == 3
+    assert stats['dead_letter_dropped'] == 1
+    # Записи dead letter не перекачиваются
+    assert pulse_spool.is_empty()
+
+    with open(tmp_path / DEAD_LETTER_FILE, 'rb') as f:
+        assert list(RECORD.iter_unpack(f.read())) == [(7, 1.0, 1), (7, 2.0, 2), (8, 3.0, 1)]
+
+    pulse_spool.close()
+    assert make_spool(tmp_path).get_stats()['dead_letter_records'] == 3
+
+
+def test_resolve_provisional_ids():
+    records = [(-1, 1.0, 1), (-2, 2.0, 2), (15, 3.0, 1), (-3, 4.0, 1)]
+    assert resolve_provisional_ids(records, [11, 12]) == [
+        (11, 1.0, 1), (12, 2.0, 2), (15, 3.0, 1), (-3, 4.0, 1)
+    ]
+
+
+def test_replayer_survives_spool_io_errors(tmp_path, monkeypatch):
+    pulse_spool = make_spool(tmp_path)
+    pulse_spool.append(1, 1.0, 1)
+    written = []
+    real_commit = pulse_spool.commit
+    failures = [OSError(errno.ENOSPC, 'No space left on device')]
+
+    def flaky_commit(batch):
+        if failures:
+            raise failures.pop()
+        real_commit(batch)
+
+    monkeypatch.setattr(pulse_spool, 'commit', flaky_commit)
+
+    def sink(records):
+        written.extend(records)
+        return {'success': True, 'rejected': []}
+
+    replayer = spool.SpoolReplayer(pulse_spool, sink, retry_min=0.01, retry_max=0.01)
+    replayer.start()
+    try:
+        for _ in range(200):
+            if pulse_spool.is_empty():
+                break
+            replayer._stop.wait(0.01)
+    finally:
+        replayer.stop()
+
+    assert pulse_spool.is_empty()
+    # Пачка повторена после ошибки диска: доставка "как минимум один раз"
+    assert written == [(1, 1.0, 1), (1, 1.0, 1)]
@@ -1,13 +1,30 @@
 from flask import Flask, render_template, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from sqlalchemy import text
 import logging
 from database import db_manager
 from mqtt_client import mqtt_client
+from spool import pulse_spool
+from reports import consumption_reports, REPORT_KINDS
+from serialization import dumps, dumps_bytes
 from config import config
 from datetime import datetime
 
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask на базе dumps(): время сериализуется в ISO 8601"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys))
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj, sort_keys=self.sort_keys), mimetype=self.mimetype)
+
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.config['SECRET_KEY'] = config.SECRET_KEY
 CORS(app)
 
@@ -22,9 +39,9 @@ def index():
 
 @app.route('/api/current', methods=['GET'])
 def get_current_readings():
-    """Получение текущих показаний всех счетчиков"""
+    """Получение текущих показаний всех счетчиков (фильтры ?site=...&group_name=...)"""
     try:
-        readings = db_manager.get_current_readings()
+        readings = db_manager.get_current_readings(request.args.get('site'), request.args.get('group_name'))
         return jsonify({
             'success': True,
             'data': readings,
@@ -40,9 +57,7 @@ def get_current_readings():
 def get_counter_data(counter_id):
     """Получение данных конкретного счетчика"""
     try:
-        # Получаем все счетчики
-        all_counters = db_manager.get_current_readings()
-        current = next((c for c in all_counters if c['id'] == counter_id), None)
+        current = db_manager.get_counter(counter_id)
 
         if not current:
             return jsonify({'success': False, 'error': 'Counter not found'}), 404
@@ -100,8 +115,10 @@ def get_consumption_for_period():
                 'counter_id': counter_id
             })
         else:
-            # Для всех счетчиков
-            results = db_manager.get_all_consumption_for_period(start_time, end_time)
+            # Для всех счетчиков, опционально только здания/стояка
+            results = db_manager.get_all_consumption_for_period(
+                start_time, end_time, data.get('site'), data.get('group_name')
+            )
 
             return jsonify({
                 'success': True,
@@ -116,6 +133,48 @@ def get_consumption_for_period():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/consumption/groups', methods=['POST'])
+def get_group_consumption_for_period():
+    """Расход за период по зданиям (group_by=site) или стоякам (group_by=group_name)"""
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'success': False, 'error': 'No data provided'}), 400
+
+        start_str = data.get('start_time')
+        end_str = data.get('end_time')
+        group_by = data.get('group_by', 'site')
+        site = data.get('site')  # опционально - только одно здание
+
+        if not start_str or not end_str:
+            return jsonify({'success': False, 'error': 'start_time and end_time required'}), 400
+        if group_by not in ('site', 'group_name'):
+            return jsonify({'success': False, 'error': "group_by must be 'site' or 'group_name'"}), 400
+
+        try:
+            start_time = datetime.fromisoformat(start_str.replace('Z', '+00:00'))
+            end_time = datetime.fromisoformat(end_str.replace('Z', '+00:00'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Invalid date format: {e}'}), 400
+
+        if start_time >= end_time:
+            return jsonify({'success': False, 'error': 'start_time must be before end_time'}), 400
+
+        results = db_manager.get_group_consumption_for_period(start_time, end_time, group_by, site)
+        return jsonify({
+            'success': True,
+            'data': results,
+            'count': len(results),
+            'group_by': group_by,
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat()
+        })
+
+    except Exception as e:
+        logger.error(f"Error calculating group consumption: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/counter/reset/<int:counter_id>', methods=['POST'])
 def reset_counter(counter_id):
     """Сброс счетчика"""
@@ -146,6 +205,7 @@ def health_check():
             'status': 'healthy',
             'timestamp': datetime.now().isoformat(),
             'database': 'connected',
+            'spool': pulse_spool.get_stats(),
             'version': '1.0.0'
         })
     except Exception as e:
@@ -153,10 +213,21 @@ def health_check():
         return jsonify({
             'status': 'unhealthy',
             'error': str(e),
+            'spool': pulse_spool.get_stats(),
             'timestamp': datetime.now().isoformat()
         }), 500
 
 
+@app.route('/api/spool', methods=['GET'])
+def get_spool_stats():
+    """Метрики локального спула импульсов"""
+    return jsonify({
+        'success': True,
+        'data': pulse_spool.get_stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+
 # Добавьте эти эндпоинты в web_server.py
 
 @app.route('/api/grafana/metrics', methods=['GET'])
@@ -187,7 +258,7 @@ def get_grafana_metrics():
                     'counter': row[0],
                     'pulses_24h': row[1],
                     'liters_24h': row[2],
-                    'cubic_meters_24h': row[3]
+                    'cubic_meters_24h': str(row[3])
                 })
 
             return jsonify({
@@ -245,29 +316,49 @@ def get_grafana_timeseries():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-if __name__ == '__main__':
-    # Инициализация системы
+@app.route('/api/reports/<kind>', methods=['GET'])
+def get_report(kind):
+    """
+    Отчеты по расходу: daily, heatmap, percentiles, monthly, summary.
+    Параметры: start, end (ISO 8601, по умолчанию последние REPORT_DEFAULT_DAYS дней),
+    counter_id (можно несколько через запятую), percentiles (например 50,90,99)
+    """
+    if kind not in REPORT_KINDS:
+        return jsonify({'success': False, 'error': f'Unknown report {kind}, expected one of {REPORT_KINDS}'}), 404
+
     try:
-        logger.info("Initializing Smart Water Meter System...")
+        try:
+            start_time, end_time = consumption_reports.parse_period(
+                request.args.get('start'), request.args.get('end'), config.REPORT_DEFAULT_DAYS
+            )
 
-        # Подключение к MQTT
-        logger.info(f"Connecting to MQTT broker at {config.MQTT_HOST}:{config.MQTT_PORT}")
-        mqtt_client.connect()
+            counter_ids = [int(x) for x in request.args.get('counter_id', '').split(',') if x.strip()]
+            quantiles = [float(x) for x in request.args.get('percentiles', '').split(',') if x.strip()]
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Invalid parameter: {e}'}), 400
 
-        # Проверка подключения к БД
-        logger.info("Testing database connection...")
-        with db_manager.get_session() as session:
-            session.execute(text("SELECT 1"))
-        logger.info("Database connection successful")
+        if start_time >= end_time:
+            return jsonify({'success': False, 'error': 'start must be before end'}), 400
+        if any(q < 0 or q > 100 for q in quantiles):
+            return jsonify({'success': False, 'error': 'percentiles must be between 0 and 100'}), 400
 
-        # Создаем счетчики если их нет
-        logger.info("Initializing counters...")
-        db_manager.create_counter_if_not_exists("Холодная вода")
-        db_manager.create_counter_if_not_exists("Горячая вода")
+        report = consumption_reports.build(kind, start_time, end_time, counter_ids or None, quantiles or None)
 
-        logger.info("System started successfully")
+        return jsonify({
+            'success': True,
+            'report': kind,
+            'data': report,
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat(),
+            'timezone': config.REPORT_TIMEZONE
+        })
 
     except Exception as e:
-        logger.error(f"Failed to start system: {e}")
+        logger.error(f"Error building {kind} report: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 
-    app.run(host='0.0.0.0', port=5000, debug=config.DEBUG)
\ No newline at end of file
+if __name__ == '__main__':
+    # Запуск с MQTT и перекачкой спула в БД - так же, как main.py
+    from main import run
+    run()